@@ -13,7 +13,22 @@ check_prompt = [{"role": "system", "content": "say hi"}]
 # IMPORTS
 import yaml
 import os
-import platform
+import json
+import hashlib
+import shlex
+import shutil
+import re
+import time
+import asyncio
+import importlib
+import bisect
+import itertools
+import array
+import collections
+import heapq
+import math
+import functools
+import contextlib
 import sys
 import subprocess
 import signal
@@ -22,24 +37,13 @@ import prompt_toolkit
 import glob
 import datetime
 import colored
-import openai
 
-from pygments.lexers.shell import BashLexer
+# heavy modules that aren't needed to show the first prompt (openai, sqlite3, concurrent.futures, platform)
+# are imported where they're first used, so starting the shell stays fast
 
 # --------
 # UTILITY FUNCTIONS
 
-dir_cache = {}
-
-def confirm(prompt):
-    while True:
-        confirmation = input(f"{prompt}? (y/n)> ").lower()
-        if confirmation in ("y", "yes"):
-            return True
-        elif confirmation in ("n", "no"):
-            return False
-        else:
-            print("please answer yes or no")
 
 def toggle_bool(thebool, description="feature"):
     if thebool:
@@ -52,7 +56,7 @@ def toggle_bool(thebool, description="feature"):
     return thebool
 
 def print_color(message, color, **kwargs):
-    print(f"{color}{message}{colored.Style.reset}", *kwargs)
+    print(f"{color}{message}{colored.Style.reset}", **kwargs)
 
 def process_cmd(cmd):
     cmd = cmd.strip("`")
@@ -60,8 +64,8 @@ def process_cmd(cmd):
 
     # process any special commands
     match cmd_split[0].lower():
-        case "cd":
-            # actually change directory
+        case "cd" if not shell.enabled():
+            # actually change directory, the persistent shell does this by itself
             target_path = os.path.expanduser(" ".join(cmd_split[1:]))
 
             # default to home dir upon "cd" command without a target dir
@@ -84,137 +88,2501 @@ def process_cmd(cmd):
 
     return cmd
 
-def ai_connect(config):
-    print_color("Connecting to AI..", colored.Fore.sky_blue_1)
-    client = openai.OpenAI(base_url=config.data.get("api_url"), api_key=config.data.get("api_key"))
+class Endpoint:
+    """
+        One AI server, with its own client and a record of how fast and how reliable it has been.
+
+        latency is an EWMA of the time to the first token, so a server that slows down loses its place within a few requests.
+        A server that fails is skipped for a while, twice as long for every failure in a row, and tried again after that.
+    """
+    smoothing = 0.3  # weight of the newest time in the EWMA
+    window = 100  # recent times kept for the p95
+    min_samples = 5  # a p95 of fewer times than this isn't trusted for hedging
+    retry_after = 5  # seconds a failed server is skipped for the first time
+    max_retry_after = 300
+
+    def __init__(self, url, key, model):
+        self.settings = (url, key, model)
+        self.url = url
+        self.key = key
+        self.model = model
+        self.client = None
+        self.latency = None
+        self.latencies = collections.deque(maxlen=self.window)
+        self.requests = 0
+        self.failures = 0  # in a row
+        self.down_until = 0
+        self.error = None
+
+    def get_client(self):
+        import openai
+        if self.client is None:
+            # openai retries twice by default, that's seconds before the next server gets a chance. the router retries instead
+            self.client = openai.AsyncOpenAI(base_url=self.url, api_key=self.key, max_retries=0)
+        return self.client
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def record(self, seconds):
+        self.latency = seconds if self.latency is None else self.smoothing * seconds + (1 - self.smoothing) * self.latency
+        self.latencies.append(seconds)
+
+    def up(self):
+        self.failures = 0
+        self.down_until = 0
+        self.error = None
+
+    def down(self, error):
+        self.failures += 1
+        self.error = error
+        self.down_until = time.monotonic() + min(self.retry_after * 2 ** (self.failures - 1), self.max_retry_after)
+
+    def deadline(self):
+        """
+            returns how long this server takes to the first token at most, most of the time (its p95), or None if it hasn't answered often enough to tell
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        return percentile(sorted(self.latencies), 0.95)
+
+class AIConnection:
+    """
+        Keeps one async client per AI server, so every request reuses its keep-alive HTTP connections.
+
+        The servers are checked in the background with a cheap request, so the prompt can show up right away.
+        status is "disconnected", "connecting" or "connected". If every check fails, error holds the reason until it's reported.
+
+        With several servers in the 'api_endpoints' setting, each request goes to the fastest healthy one. One that fails is
+        skipped for a while and the next one is asked instead, and with 'api_hedge' on, a server that's slower than usual
+        gets a second request to the next server alongside it. Whichever sends a token first answers, the other is cancelled.
+    """
+    def __init__(self):
+        self.endpoints = []
+        self.hedged = 0
+        self.status = "disconnected"
+        self.error = None
+        self.task = None
+        self.on_change = None  # called whenever status changes
+
+    def get_endpoints(self, config):
+        """
+            returns the servers in the 'api_endpoints' setting, or the one in api_url if there are none.
+            servers that are still in the settings after they change keep their latency and health
+        """
+        settings = []
+        for endpoint in config.get("api_endpoints") or [{}]:
+            if isinstance(endpoint, str):
+                endpoint = {"url": endpoint}
+            settings.append((
+                endpoint.get("url", config.get("api_url")),
+                endpoint.get("key", config.get("api_key")),
+                endpoint.get("model", config.get("api_model")),
+            ))
+
+        if settings != [endpoint.settings for endpoint in self.endpoints]:
+            known = {endpoint.settings: endpoint for endpoint in self.endpoints}
+            self.endpoints = [known.get(setting) or Endpoint(*setting) for setting in settings]
+        return self.endpoints
+
+    def ranked(self, config):
+        """
+            the servers in the order they should be asked: healthy ones fastest first, then failed ones, the one that's due for a retry first.
+            servers that haven't answered yet go first, so every server gets measured
+        """
+        endpoints = self.get_endpoints(config)
+        healthy = sorted((endpoint for endpoint in endpoints if endpoint.healthy()), key=lambda endpoint: endpoint.latency or 0)
+        down = sorted((endpoint for endpoint in endpoints if not endpoint.healthy()), key=lambda endpoint: endpoint.down_until)
+        return healthy + down
+
+    def available(self):
+        """
+            whether any server is expected to answer
+        """
+        return any(endpoint.healthy() for endpoint in self.endpoints)
+
+    def connect(self, config):
+        print_color("Connecting to AI..", colored.Fore.sky_blue_1)
+        self.set_status("connecting")
+        self.error = None
+        self.task = asyncio.get_running_loop().create_task(self._check(config))
+
+    async def _check(self, config):
+        try:
+            # openai is slow to import, don't block the prompt while that happens
+            openai = await asyncio.to_thread(importlib.import_module, "openai")
+        except Exception as e:
+            if self.status == "connecting":
+                self.error = e
+                self.set_status("disconnected")
+            return
+
+        endpoints = self.get_endpoints(config)
+        results = await asyncio.gather(*(self._check_endpoint(openai, endpoint, config) for endpoint in endpoints), return_exceptions=True)
+        errors = []
+        for endpoint, result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                endpoint.down(result)
+                errors.append(f"{endpoint.url}: {result}" if len(endpoints) > 1 else result)
+            else:
+                endpoint.up()
+
+        # the user may have disconnected while we were checking
+        if self.status != "connecting":
+            return
+        if len(errors) == len(endpoints):
+            self.error = "; ".join(map(str, errors))
+            self.set_status("disconnected")
+        else:
+            self.set_status("connected")
+
+    async def _check_endpoint(self, openai, endpoint, config):
+        client = endpoint.get_client().with_options(timeout=config.get("connect_timeout"), max_retries=0)
+        try:
+            await client.models.list()
+        except openai.NotFoundError:
+            # not every server lists its models, fall back to the smallest possible completion
+            await client.chat.completions.create(
+                model=endpoint.model,
+                messages=check_prompt,
+                max_tokens=1
+            )
+
+    async def first_token(self, endpoint, config, messages, limits):
+        """
+            asks endpoint for an answer to messages, and reads it up to the first token.
+            returns (endpoint, stream, the chunks read so far, when the stream was opened)
+        """
+        start = time.perf_counter()
+        endpoint.requests += 1
+        stream = await endpoint.get_client().chat.completions.create(
+            model=endpoint.model,
+            messages=messages,
+            stream=True,
+            **limits
+        )
+        opened = time.perf_counter()
+
+        chunks = []
+        try:
+            while not chunks or not (chunks[-1].choices and chunks[-1].choices[0].delta.content):
+                try:
+                    chunks.append(await asyncio.wait_for(anext(stream), config.get("api_timeout")))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"{endpoint.url} didn't send anything for {config.get('api_timeout')} seconds")
+        except BaseException:
+            await stream.close()
+            raise
+
+        endpoint.record(time.perf_counter() - start)
+        endpoint.up()
+        return endpoint, stream, chunks, opened
+
+    async def open_stream(self, config, messages, limits):
+        """
+            starts streaming an answer to messages from the best server, failing over and hedging as needed.
+            returns what first_token returns for the server that answered
+        """
+        candidates = collections.deque(self.ranked(config))
+        attempts = {}  # task -> (endpoint, start time)
+        answered = False
+        error = None
+
+        def ask_next():
+            endpoint = candidates.popleft()
+            attempts[asyncio.ensure_future(self.first_token(endpoint, config, messages, limits))] = (endpoint, time.perf_counter())
+
+        try:
+            while candidates or attempts:
+                if not attempts:
+                    ask_next()
+
+                # hedge once the only request is taking longer than that server usually does.
+                # servers that are down are only there to fail over to, not to hedge with
+                timeout = None
+                if config.get("api_hedge") and candidates and candidates[0].healthy() and len(attempts) == 1:
+                    (endpoint, started), = attempts.values()
+                    deadline = endpoint.deadline()
+                    if deadline is not None:
+                        timeout = max(0, started + deadline - time.perf_counter())
+
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    stats.count("hedged_requests")
+                    ask_next()
+                    continue
+
+                result = None
+                for task in done:
+                    endpoint, _ = attempts.pop(task)
+                    if task.exception():
+                        error = task.exception()
+                        endpoint.down(error)
+                    elif result:
+                        # both answered at once, only one is needed. not awaited, so nothing can cancel this before result is returned
+                        asyncio.ensure_future(task.result()[1].close())
+                    else:
+                        result = task.result()
+                if result:
+                    answered = True
+                    return result
+            raise error
+        finally:
+            now = time.perf_counter()
+            for task, (endpoint, started) in attempts.items():
+                if task.done() and not task.cancelled() and not task.exception():
+                    # it answered too, after the winner. cancelling it does nothing now, its stream has to be closed
+                    asyncio.ensure_future(task.result()[1].close())
+                else:
+                    task.cancel()
+                    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+                if answered:
+                    # it lost the race, so it would have taken at least this long
+                    endpoint.record(now - started)
+
+    def set_status(self, status):
+        self.status = status
+        if self.on_change:
+            self.on_change()
+
+    def disconnect(self):
+        self.set_status("disconnected")
+
+    async def wait(self):
+        """
+            waits for a running connection check and returns whether the AI is connected
+        """
+        if self.task:
+            # cancelling the wait doesn't cancel the check, the prompt still follows it
+            await asyncio.shield(self.task)
+        return self.status == "connected"
+
+    def report_error(self):
+        if self.error:
+            print_color(f"Failed to connect to AI! error: {self.error}", colored.Fore.red)
+            print("Falling back to normal shell. Type 'connect' to reconnect. Type 'settings' to edit your settings.")
+            self.error = None
+
+    def show(self):
+        """
+            prints how each server has been doing, for the 'stats' builtin
+        """
+        if len(self.endpoints) < 2:
+            return
+        print_color("servers:", colored.Fore.sky_blue_1)
+        for endpoint in self.endpoints:
+            latency = f"first token ~{endpoint.latency * 1000:.0f}ms" if endpoint.latency is not None else "not measured yet"
+            deadline = endpoint.deadline()
+            if deadline is not None:
+                latency += f", p95 {deadline * 1000:.0f}ms"
+            health = "up" if endpoint.healthy() else f"skipped for {endpoint.down_until - time.monotonic():.0f}s more ({endpoint.error})"
+            print(f"{endpoint.url} ({endpoint.model}): {endpoint.requests} requests, {latency}, {health}")
+        print(f"hedged requests: {self.hedged}")
+
+connection = AIConnection()
+
+# shell builtins and keywords, which aren't on PATH but are valid first words of a command
+shell_builtins = (
+    ".", ":", "[", "[[", "!", "alias", "bg", "bind", "builtin", "case", "cd", "command", "declare", "dirs", "disown",
+    "echo", "eval", "exec", "exit", "export", "false", "fc", "fg", "for", "function", "getopts", "hash", "history",
+    "if", "jobs", "kill", "let", "local", "popd", "printf", "pushd", "pwd", "read", "readonly", "return", "set",
+    "shift", "shopt", "source", "test", "time", "times", "trap", "true", "type", "typeset", "ulimit", "umask",
+    "unalias", "unset", "until", "wait", "while", "{", "(",
+)
+
+# words that make an argument list read like a sentence rather than a command
+sentence_words = {
+    "a", "all", "an", "and", "any", "are", "every", "for", "from", "how", "in", "is", "it", "me", "my", "of",
+    "please", "show", "some", "that", "the", "these", "this", "those", "to", "what", "which", "with",
+}
+
+class PathIndex:
+    """
+        The names of all executables on PATH.
+        Each PATH directory is only rescanned when its mtime changes.
+    """
+    def __init__(self):
+        self.dirs = {}  # directory -> (mtime_ns, set of executable names)
+        self.names = set()
+        self.sorted_names = []  # the same names, sorted for prefix lookups
+        self.path = None
+
+    def refresh(self):
+        path = os.environ.get("PATH", "")
+        changed = path != self.path
+        self.path = path
+
+        dirs = {}
+        for directory in dict.fromkeys(path.split(os.pathsep)):
+            if not directory:
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            if directory in self.dirs and self.dirs[directory][0] == mtime:
+                dirs[directory] = self.dirs[directory]
+                continue
+
+            names = set()
+            try:
+                with os.scandir(directory) as folder:
+                    for entry in folder:
+                        try:
+                            if entry.is_file() and entry.stat().st_mode & 0o111:
+                                names.add(entry.name)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            dirs[directory] = (mtime, names)
+            changed = True
+
+        if changed or dirs.keys() != self.dirs.keys():
+            self.dirs = dirs
+            self.names = set().union(*(names for _, names in dirs.values()))
+            self.sorted_names = sorted(self.names)
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self.names
+
+    def starting_with(self, prefix, limit):
+        self.refresh()
+        return list(itertools.islice(names_starting_with(self.sorted_names, prefix), limit))
+
+def names_starting_with(sorted_names, prefix):
+    """
+        yields the names in a sorted list that start with prefix. the first one is found with a binary search
+    """
+    for index in range(bisect.bisect_left(sorted_names, prefix), len(sorted_names)):
+        if not sorted_names[index].startswith(prefix):
+            return
+        yield sorted_names[index]
+
+path_index = PathIndex()
+
+def check_syntax(cmd):
+    """
+        returns whether cmd parses as a shell command, without running it
+    """
+    shell = shutil.which("bash")
+    if not shell:
+        # shlex already checked the quoting, which is the best we can do without bash
+        return True
 
     try:
-        client.chat.completions.create(
-            model=config.data.get("api_model"),
-            messages=check_prompt
+        return subprocess.run([shell, "-n"], input=cmd, text=True, capture_output=True, timeout=2).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+def is_shell_command(cmd, mode="safe", quick=False):
+    """
+        Decides locally whether cmd is already a valid shell command, so it can run without asking the AI.
+
+        In "aggressive" mode the first word has to be a builtin, an executable, or an alias or function defined in the persistent shell,
+        and the syntax has to be valid.
+        "safe" mode also sends anything whose arguments read like a sentence to the AI. "off" always asks the AI.
+        quick only looks at the first words and leaves out the syntax check, so it's fast enough for every keystroke.
+    """
+    if mode not in ("safe", "aggressive"):
+        return False
+
+    try:
+        words = split_words(cmd, 32 if quick else None)
+    except ValueError:
+        # unbalanced quotes
+        return False
+
+    # skip environment assignments such as FOO=bar in front of the command
+    while words and re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[0]):
+        words.pop(0)
+    if not words:
+        return False
+
+    first = words[0]
+    if "/" in first:
+        known = os.path.isfile(os.path.expanduser(first)) and os.access(os.path.expanduser(first), os.X_OK)
+    else:
+        known = first in shell_builtins or first in substitutions or first in path_index or first in shell.names
+    if not known:
+        return False
+
+    if mode == "safe":
+        plain_words = [word for word in words[1:] if word.isalpha() and not os.path.exists(word)]
+        if len(plain_words) >= 3 or any(word.lower() in sentence_words for word in plain_words):
+            return False
+        # a question mark ends a question only after a plain word, not in `echo $?`, or in a glob like file? that matches something
+        last = cmd.split()[-1]
+        if len(cmd.split()) > 1 and re.fullmatch(r"[A-Za-z]+\?+", last) and not glob.glob(last):
+            return False
+
+    return quick or check_syntax(cmd)
+
+def split_words(cmd, limit=None):
+    """
+        shlex.split, up to the first limit words. the rest of cmd isn't even looked at
+    """
+    lexer = shlex.shlex(cmd, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ""
+    return list(itertools.islice(lexer, limit))
+
+def get_cache_dir():
+    """
+        returns (and creates) the directory aish keeps its caches in
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(cache_home, "aish")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_data_dir():
+    """
+        returns (and creates) the directory aish keeps data in that shouldn't be thrown away like a cache, like the history
+    """
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    path = os.path.join(data_home, "aish")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def ignore_pattern_regex(pattern):
+    """
+        translates a gitignore-style glob into a regex
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i+2:]:
+            end = pattern.index("]", i + 2)
+            regex += "[" + pattern[i+1:end].replace("\\", "\\\\").replace("!", "^", 1) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex)
+
+class IgnoreRules:
+    """
+        A set of gitignore-style rules, relative to the directory base.
+    """
+    def __init__(self, base, lines):
+        self.base = base.rstrip(os.sep)
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            # a slash at the start or in the middle ties the pattern to base, one at the end only means it's a folder
+            anchored = "/" in line.rstrip("/")
+            line = line.strip("/")
+            self.rules.append((ignore_pattern_regex(line), negate, dir_only, anchored))
+
+        # most files match no rule at all, one regex per kind of rule rules them out in bulk, see candidates()
+        self.any_anchored = self.combine(regex for regex, _, _, anchored in self.rules if anchored)
+        self.any_name = self.combine(regex for regex, _, _, anchored in self.rules if not anchored)
+
+    @staticmethod
+    def combine(regexes):
+        patterns = [f"(?:{regex.pattern})" for regex in regexes]
+        return re.compile("|".join(patterns)) if patterns else None
+
+    @classmethod
+    def from_file(cls, base):
+        try:
+            with open(os.path.join(base, ".gitignore"), 'r', errors="replace") as f:
+                return cls(base, f.readlines())
+        except OSError:
+            return None
+
+    def candidates(self, directory, names):
+        """
+            the names in directory, which is base or inside it, that a rule might match. match() has the final word on them
+        """
+        found = set()
+        if self.any_name:
+            found.update(filter(self.any_name.fullmatch, names))
+        if self.any_anchored:
+            prefix = directory[len(self.base) + 1:] + "/" if directory != self.base else ""
+            found.update(name for name in names if self.any_anchored.fullmatch(prefix + name))
+        return found
+
+    def match(self, path, is_dir):
+        """
+            returns True if path is ignored, False if it's explicitly re-included and None if no rule matched
+        """
+        rel = path[len(self.base) + 1:]
+        name = rel.rsplit("/", 1)[-1]
+        result = None
+        for regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel if anchored else name):
+                result = not negate
+        return result
+
+def get_mounts(fs_types):
+    """
+        returns the mount points that use one of the given filesystem types
+    """
+    mounts = set()
+    try:
+        with open("/proc/mounts", 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2] in fs_types:
+                    mounts.add(fields[1].replace("\\040", " "))
+    except OSError:
+        pass
+    return mounts
+
+class Walker:
+    """
+        Parallel directory walker with a time and entry budget.
+
+        Files matched by the ignore list or a .gitignore are left out. Directories matched by them,
+        and directories on network filesystems, are listed but never descended into.
+    """
+    def __init__(self, max_depth=5, ignore=(), use_gitignore=True, skip_fs_types=(), time_budget=1.0, max_entries=200000, workers=8):
+        self.max_depth = max_depth
+        self.ignore = list(ignore)
+        self.use_gitignore = use_gitignore
+        self.skip_fs_types = list(skip_fs_types)
+        self.time_budget = time_budget
+        self.max_entries = max_entries
+        self.workers = workers
+
+        self.complete = True
+        self.pending = []
+        self.errors = []
+        self._rules = {}
+
+    @property
+    def settings(self):
+        """
+            the settings that influence what ends up in a walk's results
+        """
+        return [self.max_depth, self.ignore, self.use_gitignore, self.skip_fs_types]
+
+    def walk(self, root, rels=("",), should_descend=None):
+        """
+            Lists the directories rels (relative to root) in parallel, then descends into their subdirectories.
+
+            Yields (rel, mtime_ns, {name: is_dir}) for each directory as soon as it's listed,
+            or (rel, None, None) if it couldn't be listed. Stops once the time or entry budget runs out;
+            afterwards self.complete tells whether everything was listed and self.pending holds the directories that weren't.
+        """
+        import concurrent.futures
+        root = os.path.abspath(root)
+        deadline = time.monotonic() + self.time_budget
+        self.complete = True
+        self.pending = []
+        self.errors = []
+        self._rules = {}
+        root_rules = IgnoreRules(root, self.ignore)
+        skipped_mounts = {mount for mount in get_mounts(self.skip_fs_types) if not (root + "/").startswith(mount.rstrip("/") + "/")}
+
+        entries = 0
+        pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        futures = {pool.submit(self._list, os.path.join(root, rel)): rel for rel in rels}
+        try:
+            while futures and entries < self.max_entries:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                done, _ = concurrent.futures.wait(futures, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rel = futures.pop(future)
+                    path = os.path.join(root, rel).rstrip(os.sep)
+                    mtime, children, rules = future.result()
+                    if mtime is None:
+                        yield rel, None, None
+                        continue
+
+                    if not self.use_gitignore or ".git" in children:
+                        chain = []
+                    else:
+                        chain = self._rules_for(os.path.dirname(path))
+                    if rules:
+                        chain = chain + [rules]
+                    self._rules[path] = chain
+
+                    rule_sets = [rules for rules in [root_rules] + chain if rules.rules]
+                    if rule_sets:
+                        files = [name for name, is_dir in children.items() if not is_dir]
+                        for name in set().union(*(rules.candidates(path, files) for rules in rule_sets)):
+                            if self._is_ignored(root_rules, chain, os.path.join(path, name), False):
+                                del children[name]
+                    entries += len(children)
+                    yield rel, mtime, children
+
+                    for name, is_dir in children.items():
+                        if not is_dir:
+                            continue
+
+                        child = os.path.join(rel, name)
+                        child_path = os.path.join(path, name)
+                        if child.count(os.sep) + 1 > self.max_depth or child_path in skipped_mounts:
+                            continue
+                        if self._is_ignored(root_rules, chain, child_path, True):
+                            continue
+                        if should_descend and not should_descend(child):
+                            continue
+
+                        futures[pool.submit(self._list, child_path)] = child
+        finally:
+            if futures:
+                self.complete = False
+                self.pending = list(futures.values())
+            # don't wait for listings that are still running, e.g. on a hanging mount
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _list(self, path):
+        children = {}
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as folder:
+                for entry in folder:
+                    try:
+                        children[entry.name] = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        children[entry.name] = False
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError) and len(self.errors) < 100:
+                self.errors.append((path, e))
+            return None, None, None
+
+        rules = IgnoreRules.from_file(path) if self.use_gitignore and ".gitignore" in children else None
+        return mtime, children, rules
+
+    def _rules_for(self, path):
+        """
+            returns the .gitignore rules of path and its parents within the same repository
+        """
+        if not self.use_gitignore:
+            return []
+        if path in self._rules:
+            return self._rules[path]
+
+        parent = os.path.dirname(path)
+        if parent == path or os.path.exists(os.path.join(path, ".git")):
+            chain = []
+        else:
+            chain = self._rules_for(parent)
+
+        rules = IgnoreRules.from_file(path)
+        if rules:
+            chain = chain + [rules]
+        self._rules[path] = chain
+        return chain
+
+    def _is_ignored(self, root_rules, chain, path, is_dir):
+        if root_rules.rules and path.startswith(root_rules.base + os.sep) and root_rules.match(path, is_dir):
+            return True
+
+        ignored = False
+        for rules in chain:
+            result = rules.match(path, is_dir)
+            if result is not None:
+                ignored = result
+        return ignored
+
+class FileIndex:
+    """
+        Index of every file and folder below a root directory, used for @ targeting.
+
+        The tree is stored compactly: every item is an interned basename plus the number
+        of its parent folder, so shared path prefixes are only stored once.
+        The index is persisted in the cache dir. Every directory's mtime is stored with its
+        listing, so a refresh only rescans the directories that changed since the last lookup.
+        Basenames are searched by scanning one string that holds all of them, which
+        keeps lookups in C and is cheap to rebuild after a refresh.
+    """
+    version = 2
+
+    FILE = 0
+    DIR = 1
+    FREE = 2
+
+    def __init__(self, root, walker):
+        self.root = os.path.abspath(root)
+        self.walker = walker
+        self.names = [""]                         # item -> interned basename. item 0 is the root
+        self.parents = array.array('i', [-1])     # item -> number of its parent folder
+        self.kinds = bytearray([self.DIR])        # item -> FILE, DIR or FREE
+        self.free = []                            # numbers of removed items, reused for new ones
+        self.listings = {}                        # folder item -> array of its children, for folders that were listed
+        self.mtimes = {}                          # folder item -> mtime_ns when it was last listed
+        self.pending = set()                      # relative paths of folders a walk hasn't gotten to yet
+        self.search_data = None                   # (all basenames joined by newlines, their offsets, their items), built on first search
+        self.memory = 0
+        self.dirty = False
+
+    @property
+    def cache_path(self):
+        digest = hashlib.sha1(self.root.encode()).hexdigest()[:16]
+        return os.path.join(get_cache_dir(), f"index-{digest}.json")
+
+    @property
+    def complete(self):
+        return not self.pending
+
+    def __len__(self):
+        return len(self.names) - len(self.free) - 1
+
+    @classmethod
+    def open(cls, root, walker):
+        """
+            loads the index for root from the cache dir, building it if there is none yet
+        """
+        index = cls(root, walker)
+        try:
+            with open(index.cache_path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == cls.version and data.get("root") == index.root and data.get("settings") == walker.settings:
+                # parents have to be added before their children
+                items = {"": 0}
+                for rel, (mtime, names) in sorted(data["dirs"].items(), key=lambda d: d[0].count(os.sep) if d[0] else -1):
+                    if rel in items:
+                        children = {name.rstrip("/"): name.endswith("/") for name in names}
+                        index._apply(items[rel], mtime, children, rel, items)
+                index.pending = set(data["pending"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        if not index.mtimes:
+            index.pending = {""}
+        index.dirty = False
+        index.memory = index.memory_usage()
+        return index
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        data = {
+            "version": self.version,
+            "root": self.root,
+            "settings": self.walker.settings,
+            "dirs": {
+                self.path(item): [mtime, [self.names[child] + "/" if self.kinds[child] == self.DIR else self.names[child] for child in self.listings[item]]]
+                for item, mtime in self.mtimes.items()
+            },
+            "pending": sorted(self.pending),
+        }
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+            self.dirty = False
+        except OSError as e:
+            print_color(f"warning: couldn't save file index: {e}", colored.Fore.red)
+
+    def refresh(self):
+        """
+            rescans every directory whose mtime changed since it was last listed,
+            and continues listing directories a previous walk didn't get to
+        """
+        items = {}
+        for item, old_mtime in self.mtimes.items():
+            rel = self.path(item)
+            try:
+                mtime = os.stat(os.path.join(self.root, rel)).st_mtime_ns
+            except OSError:
+                mtime = None
+
+            if mtime != old_mtime:
+                items[rel] = item
+
+        for rel in self.pending:
+            item = self.lookup(rel)
+            if item is not None:
+                items[rel] = item
+        if not items:
+            return
+
+        todo = list(items)
+        for rel, mtime, children in self.walker.walk(self.root, todo, should_descend=lambda rel: items[rel] not in self.mtimes):
+            self._apply(items[rel], mtime, children, rel, items)
+
+        self.pending = set(self.walker.pending)
+        self.search_data = None
+        self.dirty = True
+        self.memory = self.memory_usage()
+
+    def _apply(self, item, mtime, children, rel, items):
+        """
+            updates the listing of folder item. the folders in it get added to items, by relative path
+        """
+        if self.kinds[item] != self.DIR or self.path(item) != rel:
+            # already removed while applying the listing of a parent that also changed
+            return
+
+        if mtime is None:
+            # directory disappeared or became inaccessible
+            if item:
+                self.listings[self.parents[item]].remove(item)
+            self._remove(item)
+            return
+
+        old_listing = {self.names[child]: child for child in self.listings.get(item, ())}
+        listing = array.array('i')
+        for name, is_dir in children.items():
+            child = old_listing.pop(name, None)
+            if child is not None and (self.kinds[child] == self.DIR) != is_dir:
+                self._remove(child)
+                child = None
+            if child is None:
+                child = self._add(item, name, is_dir)
+
+            listing.append(child)
+            if is_dir:
+                items[os.path.join(rel, name)] = child
+
+        for child in old_listing.values():
+            self._remove(child)
+
+        self.listings[item] = listing
+        self.mtimes[item] = mtime
+        self.dirty = True
+
+    def _add(self, parent, name, is_dir):
+        name = sys.intern(name)
+        kind = self.DIR if is_dir else self.FILE
+        if self.free:
+            item = self.free.pop()
+            self.names[item] = name
+            self.parents[item] = parent
+            self.kinds[item] = kind
+        else:
+            item = len(self.names)
+            self.names.append(name)
+            self.parents.append(parent)
+            self.kinds.append(kind)
+        return item
+
+    def _remove(self, item):
+        if self.kinds[item] == self.DIR:
+            self.pending.discard(self.path(item))
+        self.mtimes.pop(item, None)
+        for child in self.listings.pop(item, ()):
+            self._remove(child)
+
+        if item:
+            self.names[item] = ""
+            self.kinds[item] = self.FREE
+            self.free.append(item)
+
+    def path(self, item):
+        """
+            returns the path of item, relative to the root
+        """
+        parts = []
+        while item > 0:
+            parts.append(self.names[item])
+            item = self.parents[item]
+        return os.path.join(*reversed(parts)) if parts else ""
+
+    def lookup(self, rel):
+        """
+            returns the item at a relative path, or None if it isn't in the index
+        """
+        item = 0
+        for name in rel.split(os.sep) if rel else ():
+            for child in self.listings.get(item, ()):
+                if self.names[child] == name:
+                    item = child
+                    break
+            else:
+                return None
+        return item
+
+    def memory_usage(self):
+        """
+            estimates how many bytes the index takes up in memory
+        """
+        size = sys.getsizeof(self.names) + sys.getsizeof(self.parents) + sys.getsizeof(self.kinds) + sys.getsizeof(self.free)
+        size += sum(sys.getsizeof(name) for name in set(self.names))
+        size += sys.getsizeof(self.listings) + sum(sys.getsizeof(listing) for listing in self.listings.values())
+        size += sys.getsizeof(self.mtimes) + 32 * len(self.mtimes)
+        if self.search_data:
+            size += sum(sys.getsizeof(part) for part in self.search_data)
+        return size
+
+    def _build_search_data(self):
+        items = array.array('i', (item for item, kind in enumerate(self.kinds) if kind != self.FREE and item))
+        names = [self.names[item] for item in items]
+        lower_names = [name.lower() for name in names]
+        self.search_data = (
+            ("\n".join(names), array.array('q', itertools.accumulate((len(name) + 1 for name in names), initial=0))),
+            ("\n".join(lower_names), array.array('q', itertools.accumulate((len(name) + 1 for name in lower_names), initial=0))),
+            items,
         )
+        self.memory = self.memory_usage()
+
+    def search(self, text, limit=None):
+        """
+            Returns (paths, total): the full paths of the best matches for text, best first, and how many items matched.
+            Folders get a trailing slash.
+
+            Like fzf, matching ignores case unless text contains an uppercase letter.
+            An exact basename beats a prefix, a prefix beats a substring, shallow paths beat deep ones and
+            recently used paths get a boost. If no basename contains text, basenames that contain its characters in order are used instead.
+        """
+        if self.search_data is None:
+            self._build_search_data()
+        case_sensitive = text != text.lower()
+        (blob, offsets), items = self.search_data[0 if case_sensitive else 1], self.search_data[2]
+        query = text if case_sensitive else text.lower()
+
+        # every match is (index of the basename, length of the matched span)
+        matches = []
+        position = blob.find(query)
+        while position != -1:
+            index = bisect.bisect_right(offsets, position) - 1
+            matches.append((index, len(query)))
+
+            # continue with the next basename, so every item is only reported once
+            position = blob.find(query, offsets[index + 1])
+
+        fuzzy = not matches and len(query) > 1
+        if fuzzy:
+            regex = re.compile("[^\n]*?".join(map(re.escape, query)))
+            match = regex.search(blob)
+            while match:
+                index = bisect.bisect_right(offsets, match.start()) - 1
+                matches.append((index, match.end() - match.start()))
+                match = regex.search(blob, offsets[index + 1])
+
+        boosts = recent_targets.boosts(self)
+        def score(match):
+            index, span = match
+            item = items[index]
+            name = blob[offsets[index]:offsets[index + 1] - 1]
+            if fuzzy:
+                score = 50 - (span - len(query))
+            elif name == query:
+                score = 300
+            elif name.rsplit(".", 1)[0] == query:
+                score = 250
+            elif name.startswith(query):
+                score = 200
+            elif name[name.find(query) - 1] in "._- ":
+                score = 150
+            else:
+                score = 100
 
-        print_color("Connected!", colored.Fore.green)
-        return client
+            depth = 0
+            while item > 0:
+                depth += 1
+                item = self.parents[item]
+            return score - 10 * depth - len(name) / 10 + boosts.get(items[index], 0)
 
-    except Exception as e:
-        print_color(f"Failed to connect to AI! error: {e}", colored.Fore.red)
-        print("Falling back to normal shell. Type 'connect' to reconnect. Type 'settings' to edit your settings.")
+        best = heapq.nlargest(limit or len(matches), matches, key=score)
+
+        results = []
+        for index, _ in best:
+            item = items[index]
+            path = os.path.join(self.root, self.path(item))
+            results.append(path + "/" if self.kinds[item] == self.DIR else path)
+        return results, len(matches)
+
+class RecentTargets:
+    """
+        Remembers which paths were recently targeted with @, so they can be ranked higher.
+        Stored in the cache dir.
+    """
+    max_paths = 500
+    half_life = 3 * 24 * 60 * 60
+
+    def __init__(self):
+        self.used = None  # path -> time it was last used
+
+    @property
+    def cache_path(self):
+        return os.path.join(get_cache_dir(), "recent_targets.json")
 
+    def load(self):
+        if self.used is not None:
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                self.used = dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            self.used = {}
+
+    def mark(self, paths):
+        self.load()
+        for path in paths:
+            self.used.pop(path.rstrip("/"), None)
+            self.used[path.rstrip("/")] = time.time()
+
+        # dicts keep insertion order, so the oldest entries come first
+        while len(self.used) > self.max_paths:
+            del self.used[next(iter(self.used))]
+
+        try:
+            with open(self.cache_path, 'w') as f:
+                json.dump(list(self.used.items()), f)
+        except OSError:
+            pass
+
+    def boosts(self, index):
+        """
+            returns {item: boost} for the recently used items in a file index. the boost halves every few days
+        """
+        self.load()
+        boosts = {}
+        now = time.time()
+        for path, used in self.used.items():
+            if path.startswith(index.root + os.sep):
+                item = index.lookup(path[len(index.root) + 1:])
+                if item:
+                    boosts[item] = 100 * 0.5 ** ((now - used) / self.half_life)
+        return boosts
+
+recent_targets = RecentTargets()
+
+def mark_used_targets(cmd, relevant_paths):
+    """
+        remembers which of the @ target candidates ended up in a command that was run
+    """
+    used = [path for path in relevant_paths if path.rstrip("/") in cmd]
+    if used:
+        recent_targets.mark(used)
+
+# least recently used first
+file_indexes = collections.OrderedDict()
+
+def get_file_index(path):
+    """
+        returns the up-to-date file index for path, loading it from the cache dir on first use
+    """
+    path = os.path.abspath(path)
+    if path not in file_indexes:
+        walker = Walker(
+            max_depth=config.get("target_max_depth"),
+            ignore=config.get("target_ignore"),
+            use_gitignore=config.get("target_gitignore"),
+            skip_fs_types=config.get("target_skip_fs_types"),
+            time_budget=config.get("target_time_budget"),
+            max_entries=config.get("target_max_entries"),
+        )
+        file_indexes[path] = FileIndex.open(path, walker)
+
+    file_indexes.move_to_end(path)
+    index = file_indexes[path]
+    index.refresh()
+    index.save()
+
+    # stay within the memory budget by dropping the least recently used indexes. they're reloaded from the cache dir when needed again
+    budget = config.get("target_cache_memory_mb") * 1024 * 1024
+    while len(file_indexes) > 1 and sum(index.memory for index in file_indexes.values()) > budget:
+        file_indexes.popitem(last=False)
+
+    return index
+
+def normalize_request(request):
+    """
+        the request without differences that can't change its answer: extra whitespace and trailing punctuation.
+        case stays, Notes.txt and notes.txt are different files
+    """
+    return " ".join(request.split()).rstrip(".?!")
+
+class ResponseCache:
+    """
+        Remembers which command the AI answered for a request, so repeated requests don't need a round-trip.
+
+        Answers are stored in an SQLite database in the cache dir, keyed by the normalized request,
+        the model, the system prompt and the context of the current directory.
+        Entries expire after a TTL, and the least recently used ones are evicted when there are too many.
+    """
+    def __init__(self):
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        return os.path.join(get_cache_dir(), "responses.sqlite")
+
+    def connect(self):
+        if self.db is None:
+            import sqlite3
+            self.db = sqlite3.connect(self.path)
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    request TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        return self.db
+
+    @staticmethod
+    def key(request, model, system_prompt, context):
+        parts = [normalize_request(request), model] + [hashlib.sha256(part.encode()).hexdigest() for part in (system_prompt, context)]
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def get(self, key):
+        """
+            returns the cached command for key, or None if there is no fresh one
+        """
+        db = self.connect()
+        now = time.time()
+        row = db.execute("SELECT command, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and now - row[1] < config.get("response_cache_ttl_hours") * 3600:
+            with db:
+                db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
         return None
 
-def recursive_list(root_dir=".", max_depth=5):
+    def put(self, key, request, model, command):
+        db = self.connect()
+        now = time.time()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, request, command, model, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, request, command, model, now, now)
+            )
+            db.execute("DELETE FROM responses WHERE created < ?", (now - config.get("response_cache_ttl_hours") * 3600,))
+            db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (config.get("response_cache_max_entries"),)
+            )
+
+    def stats(self):
+        db = self.connect()
+        entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return entries, size
+
+    def clear(self):
+        db = self.connect()
+        with db:
+            db.execute("DELETE FROM responses")
+        db.execute("VACUUM")
+
+response_cache = ResponseCache()
+
+class CommandHistory(prompt_toolkit.history.History):
     """
-    Recursively list files and directories up to max_depth levels deep.
-    
-    Args:
-        root_dir (str): The root directory path.
-        max_depth (int): Maximum depth to traverse (default is 3).
-        
-    Returns:
-        list: List of full paths (strings) for files and directories.
+        Everything typed at the prompt, kept in an SQLite database in the data dir.
+
+        Each entry also has the directory it was typed in, the command that ran for it (the AI's answer, for requests),
+        its exit status and how long it ran. Every distinct input has a row of its own in a table keyed by the input,
+        so a suggestion is a range lookup in that index instead of a scan through the whole history.
+        Entries older than 'history_max_age_days' or beyond 'history_max_entries' are removed once a day.
+        The old ~/.aish_history file is imported the first time.
     """
-    items = []
-    
-    def _list_items(current_path, current_depth):
+    legacy_path = os.path.expanduser("~/.aish_history")
+
+    def __init__(self):
+        super().__init__()
+        self.db = None
+        self.current = None  # id of the entry for the input that's being handled
+        self.suggest_candidates = 1000  # inputs with the typed prefix that are compared directly, more are searched by recency
+
+    @property
+    def path(self):
+        return os.path.join(get_data_dir(), "history.sqlite")
+
+    def open(self):
+        import sqlite3
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        with db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY,
+                    time REAL NOT NULL,
+                    cwd TEXT,
+                    input TEXT NOT NULL,
+                    command TEXT,
+                    status INTEGER,
+                    duration REAL
+                )
+            """)
+            db.execute("CREATE TABLE IF NOT EXISTS inputs (input TEXT PRIMARY KEY, last_used REAL NOT NULL) WITHOUT ROWID")
+            db.execute("CREATE INDEX IF NOT EXISTS inputs_last_used ON inputs (last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID")
+        return db
+
+    def connect(self):
+        # loading runs in a thread of its own with its own connection, this one is for the main thread
+        if self.db is None:
+            self.db = self.open()
+        return self.db
+
+    @staticmethod
+    def get_meta(db, key):
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def set_meta(db, key, value):
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load_history_strings(self):
+        """
+            the most recently used distinct inputs, newest first, for browsing with the arrow keys
+        """
+        db = self.open()
+        try:
+            if not self.get_meta(db, "imported"):
+                self.import_file(db)
+            if time.time() - (self.get_meta(db, "compacted") or 0) > 86400:
+                self.compact(db)
+            rows = db.execute("SELECT input FROM inputs ORDER BY last_used DESC LIMIT ?", (config.get("history_load_limit"),)).fetchall()
+        finally:
+            db.close()
+
+        for (line,) in rows:
+            yield line
+
+    def import_file(self, db):
+        """
+            imports the history file that aish used to keep. the file itself is left alone
+        """
+        entries = []
+        lines = []
+        stamp = None
+
+        def add():
+            if lines:
+                entries.append((stamp, "".join(lines)[:-1]))
+
         try:
-            with os.scandir(current_path) as folder:
-                for file in folder:
-                    items.append(file.path)
-                    if file.is_dir() and current_depth < max_depth:
-                        _list_items(file.path, current_depth + 1)
-        except:
-            # Skip inaccessible things
+            with open(self.legacy_path, "rb") as f:
+                for line in f:
+                    line = line.decode("utf-8", errors="replace")
+                    if line.startswith("+"):
+                        lines.append(line[1:])
+                        continue
+
+                    add()
+                    lines = []
+                    if line.startswith("# "):
+                        try:
+                            stamp = datetime.datetime.fromisoformat(line[2:].strip()).timestamp()
+                        except ValueError:
+                            pass
+                add()
+        except FileNotFoundError:
             pass
-    
-    _list_items(root_dir, 0)  # Start at depth 0 (root)
-    return items
 
-def get_dir_list(path):
+        now = time.time()
+        entries = [(stamp or now, text) for stamp, text in entries]
+        with db:
+            db.executemany("INSERT INTO history (time, input) VALUES (?, ?)", entries)
+            db.executemany(
+                "INSERT INTO inputs (input, last_used) VALUES (?, ?) ON CONFLICT (input) DO UPDATE SET last_used = max(last_used, excluded.last_used)",
+                ((text, stamp) for stamp, text in entries)
+            )
+            self.set_meta(db, "imported", now)
+
+    def compact(self, db):
+        """
+            removes entries that are past the retention settings, and shrinks the file once a good part of it is unused
+        """
+        now = time.time()
+        max_entries = config.get("history_max_entries")
+        max_age_days = config.get("history_max_age_days")
+        with db:
+            if max_age_days:
+                db.execute("DELETE FROM history WHERE time < ?", (now - max_age_days * 86400,))
+                db.execute("DELETE FROM inputs WHERE last_used < ?", (now - max_age_days * 86400,))
+            db.execute("DELETE FROM history WHERE id <= (SELECT max(id) FROM history) - ?", (max_entries,))
+            db.execute(
+                "DELETE FROM inputs WHERE input IN (SELECT input FROM inputs ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (max_entries,)
+            )
+            self.set_meta(db, "compacted", now)
+
+        free = db.execute("PRAGMA freelist_count").fetchone()[0]
+        pages = db.execute("PRAGMA page_count").fetchone()[0]
+        if free > pages / 4:
+            db.execute("VACUUM")
+
+    def store_string(self, string):
+        db = self.connect()
+        now = time.time()
+        with db:
+            self.current = db.execute(
+                "INSERT INTO history (time, cwd, input) VALUES (?, ?, ?)",
+                (now, os.getcwd(), string)
+            ).lastrowid
+            db.execute(
+                "INSERT INTO inputs (input, last_used) VALUES (?, ?) ON CONFLICT (input) DO UPDATE SET last_used = excluded.last_used",
+                (string, now)
+            )
+
+    def record(self, command, status, duration, entry=None):
+        """
+            adds the command that ran for an input, with its exit status and duration in seconds.
+            entry is the id of that input, the current one if it's not given
+        """
+        entry = self.current if entry is None else entry
+        if entry is None:
+            return
+        db = self.connect()
+        with db:
+            db.execute(
+                "UPDATE history SET command = ?, status = ?, duration = ? WHERE id = ?",
+                (command, status, duration, entry)
+            )
+
+    def suggest(self, text):
+        """
+            returns the most recently used input that starts with text
+        """
+        if not text or ord(text[-1]) == sys.maxunicode:
+            return None
+        # every string that starts with text sorts between text and text with its last character bumped up by one
+        upper = text[:-1] + chr(ord(text[-1]) + 1)
+        db = self.connect()
+        rows = db.execute(
+            "SELECT input, last_used FROM inputs WHERE input > ? AND input < ? LIMIT ?",
+            (text, upper, self.suggest_candidates + 1)
+        ).fetchall()
+        if len(rows) <= self.suggest_candidates:
+            return max(rows, key=lambda row: row[1])[0] if rows else None
+
+        # so many inputs start with text that one of the recent ones is likely to, go through them newest first
+        row = db.execute(
+            "SELECT input FROM inputs INDEXED BY inputs_last_used WHERE input > ? AND input < ? ORDER BY last_used DESC LIMIT 1",
+            (text, upper)
+        ).fetchone()
+        return row[0] if row else None
+
+command_history = CommandHistory()
+
+class HistorySuggestion(prompt_toolkit.auto_suggest.AutoSuggest):
+    """
+        Suggests the rest of the line from the history, like AutoSuggestFromHistory but with an index lookup
+    """
+    def __init__(self, history):
+        self.history = history
+
+    def get_suggestion(self, buffer, document):
+        text = document.text.rsplit("\n", 1)[-1]
+        if not text.strip():
+            return None
+
+        line = self.history.suggest(text)
+        if line:
+            return prompt_toolkit.auto_suggest.Suggestion(line[len(text):])
+        return None
+
+class Examples:
+    """
+        Earlier requests with the commands the user accepted for them, shown to the AI as examples of what they want.
+
+        Pairs are kept in the history database and searched with BM25 over the words of the request, in memory.
+        The index is built the first time it's needed, and each newly accepted pair is added to it right away.
+    """
+    k1 = 1.2
+    b = 0.75
+    min_similarity = 0.2
+
+    def __init__(self):
+        self.pairs = []  # [(request, command)], oldest first
+        self.lengths = []  # number of words in each request
+        self.postings = collections.defaultdict(dict)  # word -> {pair number: times it's in the request}
+        self.known = set()
+        self.total_length = 0
+        self.loaded = False
+
+    @staticmethod
+    def words(text):
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+
+        db = command_history.connect()
+        with db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS examples (
+                    request TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    time REAL NOT NULL,
+                    PRIMARY KEY (request, command)
+                ) WITHOUT ROWID
+            """)
+
+        if not command_history.get_meta(db, "examples_imported"):
+            # requests that were answered before examples were kept are still in the response cache
+            rows = response_cache.connect().execute(
+                "SELECT request, command, last_used FROM responses WHERE lower(trim(request)) != lower(trim(command))"
+            ).fetchall()
+            with db:
+                db.executemany("INSERT OR IGNORE INTO examples (request, command, time) VALUES (?, ?, ?)", rows)
+                command_history.set_meta(db, "examples_imported", time.time())
+
+        for request, command in db.execute("SELECT request, command FROM examples ORDER BY time"):
+            self.index(request, command)
+
+    def index(self, request, command):
+        if (request, command) in self.known:
+            return
+        self.known.add((request, command))
+
+        number = len(self.pairs)
+        words = self.words(request)
+        self.pairs.append((request, command))
+        self.lengths.append(len(words))
+        self.total_length += len(words)
+        for word, count in collections.Counter(words).items():
+            self.postings[word][number] = count
+
+    def add(self, request, command):
+        """
+            remembers that command was accepted for request
+        """
+        self.load()
+        db = command_history.connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO examples (request, command, time) VALUES (?, ?, ?)", (request, command, time.time()))
+        self.index(request, command)
+
+    def search(self, request, count):
+        """
+            returns up to count [(similarity, request, command)], most similar first.
+            similarity is the BM25 score divided by the score of an identical request, so 1 is as similar as it gets
+        """
+        words = collections.Counter(self.words(request))
+        if count <= 0 or not words:
+            return []
+        self.load()
+        if not self.pairs:
+            return []
+
+        average_length = self.total_length / len(self.pairs)
+        query_length = sum(words.values())
+        scores = collections.defaultdict(float)
+        best = 0.0
+        for word, query_count in words.items():
+            postings = self.postings.get(word, {})
+            idf = math.log(1 + (len(self.pairs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            best += idf * query_count * (self.k1 + 1) / (query_count + self.k1 * (1 - self.b + self.b * query_length / average_length))
+            for number, pair_count in postings.items():
+                scores[number] += idf * pair_count * (self.k1 + 1) / (pair_count + self.k1 * (1 - self.b + self.b * self.lengths[number] / average_length))
+
+        # on equal scores, the most recently accepted pair wins
+        top = heapq.nlargest(count, scores.items(), key=lambda item: (item[1], item[0]))
+        return [
+            (min(score / best, 1.0), *self.pairs[number])
+            for number, score in top
+            if score / best >= self.min_similarity
+        ]
+
+examples = Examples()
+
+class Context:
+    """
+        The context sent to the AI along with a request, split into named sections.
+
+        Static sections (the instructions, environment and system info) come first and are byte-identical
+        between requests, so servers with a prompt cache (llama.cpp, vLLM) can reuse their work on them.
+        The sections that change between requests go into the last user message, in front of the request,
+        with the directory listing trimmed to a token budget. Chat templates only allow a system message at the start.
+    """
+    def __init__(self, request, target_lines=()):
+        self.request = request
+        self.static = [
+            ("instructions", config.get("prompt")),
+            ("environment", f"User's home directory is `{os.path.expanduser('~')}`.\nEnvironment variables: {env_vars_display}\nSystem information: {get_sys_info()}"),
+        ]
+        self.volatile = [
+            ("directory", f"You are currently in directory `{os.getcwd()}`."),
+            ("date", f"The current date is {datetime.datetime.now().strftime('%b %d %Y %H:%M')}."),
+            ("files", f"Files in current directory: {summarize_listing(os.getcwd(), config.get('listing_token_budget'))}"),
+        ]
+        if last_command.wanted(request):
+            self.volatile.append(("last command", last_command.describe(config.get("output_token_budget"))))
+        if target_lines:
+            self.volatile.append(("targets", "You can find target files at one of these paths:\n" + "\n".join(target_lines)))
+        # earlier requests like this one, with the commands the user accepted for them
+        self.examples = examples.search(request, config.get("examples_count"))
+
+    def messages(self):
+        messages = [{"role": "system", "content": "\n\n".join(text for _, text in self.static)}]
+        # the most similar example goes last, closest to the request
+        for _, request, command in reversed(self.examples):
+            messages.append({"role": "user", "content": request})
+            messages.append({"role": "assistant", "content": command})
+        volatile = "\n".join(text for _, text in self.volatile)
+        messages.append({"role": "user", "content": f"{volatile}\n\nRequest: {self.request}"})
+        return messages
+
+    def cache_key(self, model):
+        """
+            the response cache key for this request. the date and the examples are left out on purpose,
+            everything else the answer depends on is in it
+        """
+        return response_cache.key(
+            self.request,
+            model,
+            "\n\n".join(text for _, text in self.static),
+            "\n".join(text for name, text in self.volatile if name != "date")
+        )
+
+    def show(self):
+        """
+            prints every section with its estimated token count
+        """
+        total = 0
+        for kind, sections in (("static", self.static), ("volatile", self.volatile)):
+            for name, text in sections:
+                tokens = estimate_tokens(text)
+                total += tokens
+                print_color(f"--- {name} ({kind}, ~{tokens} tokens)", colored.Fore.sky_blue_1)
+                print(text.strip())
+
+            if kind == "static" and self.examples:
+                text = "\n".join(f"{request} -> {command} (similarity {similarity:.2f})" for similarity, request, command in self.examples)
+                tokens = estimate_tokens(text)
+                total += tokens
+                print_color(f"--- examples (~{tokens} tokens)", colored.Fore.sky_blue_1)
+                print(text)
+        print_color(f"--- total: ~{total} tokens, plus the request", colored.Fore.sky_blue_1)
+
+def summarize_listing(path, budget):
+    """
+        Lists the files in path for the AI, with a trailing slash on folders.
+        If the listing doesn't fit in the token budget, it's cut off and the rest is summarized by file type.
+    """
+    names = []
+    try:
+        with os.scandir(path) as folder:
+            for entry in folder:
+                try:
+                    names.append(entry.name + "/" if entry.is_dir() else entry.name)
+                except OSError:
+                    names.append(entry.name)
+    except OSError as e:
+        return f"(couldn't be listed: {e.strerror})"
+    names.sort()
+
+    shown = 0
+    tokens = 0
+    for name in names:
+        tokens += estimate_tokens(name)
+        if tokens > budget:
+            break
+        shown += 1
+
+    if shown == len(names):
+        return ", ".join(names)
+
+    rest = names[shown:]
+    kinds = collections.Counter("folders" if name.endswith("/") else f"*{os.path.splitext(name)[1]}" if os.path.splitext(name)[1] else "other files" for name in rest)
+    summary = ", ".join(f"{count} {kind}" for kind, count in kinds.most_common(8))
+    return ", ".join(names[:shown]) + f", ... and {len(rest)} more ({summary})"
+
+class CommandStream:
+    """
+        Picks the command out of an AI answer while it's being streamed.
+
+        Thinking blocks and code fences are dropped as they arrive, and the answer is done
+        as soon as a complete command line has arrived, so the rest doesn't need to be waited for.
+    """
+    think_start = "<think>"
+    think_end = "</think>"
+    fence = "```"
+
+    def __init__(self):
+        self.pending = ""  # received text that can't be classified yet
+        self.command = ""
+        self.thinking = False
+        self.done = False
+
+    def feed(self, text):
+        """
+            adds a chunk of the answer, and returns the part of it that belongs to the command
+        """
+        self.pending += text
+        output = ""
+        while self.pending and not self.done:
+            if self.thinking:
+                end = self.pending.find(self.think_end)
+                if end == -1:
+                    # keep enough to recognize a closing tag that's split over two chunks
+                    self.pending = self.pending[-len(self.think_end):]
+                    break
+                self.pending = self.pending[end + len(self.think_end):]
+                self.thinking = False
+                continue
+
+            if not self.command:
+                # at the start of the answer, anything that could still become a thinking block or a fence has to wait
+                self.pending = self.pending.lstrip()
+                if self.pending.startswith(self.think_start):
+                    self.pending = self.pending[len(self.think_start):]
+                    self.thinking = True
+                    continue
+                if self.pending.startswith(self.fence):
+                    newline = self.pending.find("\n")
+                    if newline == -1:
+                        break
+                    self.pending = self.pending[newline + 1:]
+                    continue
+                if self.think_start.startswith(self.pending) or self.fence.startswith(self.pending):
+                    break
+
+            newline = self.pending.find("\n")
+            line = self.pending if newline == -1 else self.pending[:newline]
+            self.pending = "" if newline == -1 else self.pending[newline:]
+            self.command += line
+            output += line
+            if newline != -1:
+                self.done = True
+
+        return output
+
+    def result(self):
+        return self.command.strip().strip("`").strip()
+
+def estimate_tokens(text):
+    """
+        rough token count, good enough for budgeting prompt space
+    """
+    return len(text) // 4 + 1
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def show_cache():
+    """
+        prints how much memory the @ target cache is using, and how well the response cache is doing
+    """
+    print_color("scanned folders:", colored.Fore.sky_blue_1)
+    for root, index in reversed(file_indexes.items()):
+        incomplete = "" if index.complete else ", incomplete"
+        print(f"{format_size(index.memory):>10}  {root} ({len(index)} paths{incomplete})")
+    total = sum(index.memory for index in file_indexes.values())
+    print(f"{format_size(total):>10}  total, budget is {config.get('target_cache_memory_mb')} MB")
+
+    entries, size = response_cache.stats()
+    lookups = response_cache.hits + response_cache.misses
+    hit_rate = f"{response_cache.hits / lookups:.0%}" if lookups else "n/a"
+    print_color("AI responses:", colored.Fore.sky_blue_1)
+    print(f"{entries} cached commands ({format_size(size)} on disk), at most {config.get('response_cache_max_entries')} kept for {config.get('response_cache_ttl_hours')} hours")
+    print(f"{response_cache.hits} hits, {response_cache.misses} misses this session (hit rate {hit_rate})")
+
+    if config.get("speculative"):
+        print_color("speculative requests:", colored.Fore.sky_blue_1)
+        print(f"{speculation.started} sent while typing, {speculation.hits} used, {speculation.wasted} wasted")
+
+def clear_cache():
+    """
+        forgets every cached directory tree and AI response, both in memory and in the cache dir
+    """
+    file_indexes.clear()
+    for path in glob.glob(os.path.join(get_cache_dir(), "index-*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    response_cache.clear()
+    print_color("cache cleared", colored.Fore.sky_blue_1)
+
+def percentile(values, fraction):
+    """
+        nearest-rank percentile of a sorted list
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+class Stats:
+    """
+        Where the time goes, for the 'stats' builtin and the optional 'trace_file'.
+
+        Timings are kept per phase for the whole session. Everything that happens while one input is handled
+        is also collected in one record, which is appended to the trace file as a JSON line when it's done.
+        Token counts are estimates: the stream is closed as soon as the command is complete, before a server would send its usage.
+    """
+    phases = (
+        ("target_scan", "scanning for @ targets"),
+        ("target_search", "searching @ targets"),
+        ("context", "building the context"),
+        ("request", "sending the request"),
+        ("first_token", "time to first token"),
+        ("stream", "streaming the answer"),
+        ("confirm", "waiting for confirmation"),
+        ("command", "running the command"),
+        ("total", "whole request"),
+    )
+
+    def __init__(self):
+        self.timings = collections.defaultdict(list)  # phase -> seconds for each time it happened
+        self.counts = collections.Counter()
+        self.token_rates = []  # tokens per second of each streamed answer
+        self.request = None
+
+    def begin(self, text):
+        self.request = {"time": time.time(), "input": text, "model": config.data.get("api_model"), "timings_ms": {}, "counts": {}}
+        self.request_start = time.perf_counter()
+
+    def end(self):
+        if self.request is None:
+            return
+        self.add("total", time.perf_counter() - self.request_start)
+
+        trace_file = config.get("trace_file")
+        if trace_file:
+            try:
+                with open(os.path.expanduser(trace_file), 'a') as f:
+                    f.write(json.dumps(self.request) + "\n")
+            except OSError as e:
+                print_color(f"couldn't write to the trace file: {e}", colored.Fore.red)
+        self.request = None
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, seconds):
+        self.timings[phase].append(seconds)
+        if self.request is not None:
+            self.request["timings_ms"][phase] = self.request["timings_ms"].get(phase, 0) + seconds * 1000
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+        if self.request is not None:
+            self.request["counts"][name] = self.request["counts"].get(name, 0) + amount
+
+    def answered(self, source):
+        """
+            records where the answer to the current request came from: ai, cache, example, speculation or shell
+        """
+        self.count(f"answer_{source}")
+        self.note("answer", source)
+
+    def note(self, key, value):
+        """
+            adds a detail about the current request to its trace record
+        """
+        if self.request is not None:
+            self.request[key] = value
+
+    def show(self):
+        print_color(f"{'':<24}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}", colored.Fore.sky_blue_1)
+        for phase, description in self.phases:
+            values = sorted(self.timings.get(phase, ()))
+            if not values:
+                continue
+            columns = "".join(f"{percentile(values, fraction) * 1000:>8.0f}ms" for fraction in (0.5, 0.9, 0.99, 1))
+            print(f"{description:<24}{len(values):>7}{columns}")
+
+        if self.token_rates:
+            rates = sorted(self.token_rates)
+            print(f"tokens per second: p50 {percentile(rates, 0.5):.1f}, p10 {percentile(rates, 0.1):.1f}")
+        print(f"tokens (estimated): ~{self.counts['prompt_tokens']} sent, ~{self.counts['completion_tokens']} received")
+
+        answers = ", ".join(f"{self.counts[f'answer_{source}']} {description}" for source, description in (
+            ("ai", "from the AI"),
+            ("cache", "from the response cache"),
+            ("example", "from earlier accepted commands"),
+            ("speculation", "speculated while typing"),
+            ("shell", "ran without the AI"),
+        ))
+        print(f"answers: {answers}")
+
+stats = Stats()
+
+class OutputBuffer:
+    """
+        The end of a command's output, in a fixed amount of memory.
+
+        Output is copied into a ring buffer that's allocated once. When it's full the oldest bytes are overwritten,
+        so a command that never stops printing, like journalctl -f, costs no more memory than a short one.
+        tail() hands out memoryviews of the buffer instead of copies. With a capacity of 0 nothing is kept, only counted.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(capacity, 0)
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+        self.end = 0  # where the next byte goes
+        self.total = 0  # bytes written, including the ones that were overwritten since
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def clear(self):
+        self.end = 0
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        if not self.capacity:
+            return
+        if len(data) >= self.capacity:
+            self.view[:] = memoryview(data)[-self.capacity:]
+            self.end = 0
+            return
+
+        first = min(len(data), self.capacity - self.end)
+        self.view[self.end:self.end + first] = data[:first]
+        self.view[:len(data) - first] = data[first:]
+        self.end = (self.end + len(data)) % self.capacity
+
+    def tail(self, size):
+        """
+            returns the last size bytes (or fewer, if there aren't that many) as one or two memoryviews, oldest first
+        """
+        size = min(size, len(self))
+        if size <= 0:
+            return []
+        start = (self.end - size) % self.capacity
+        if start + size <= self.capacity:
+            return [self.view[start:start + size]]
+        return [self.view[start:], self.view[:self.end]]
+
+# escape sequences for colors, cursor movement and window titles
+escape_sequence = re.compile(r"\x1b(\[[0-9;?]*[ -/]*[@-~]|\][^\x07\x1b]*(\x07|\x1b\\)?|[@-Z\\-_])")
+
+def clean_output(text):
+    """
+        turns what a command wrote to the terminal into plain lines: no escape sequences,
+        and only what's left of a line after it was overwritten with carriage returns, like progress bars do
+    """
+    text = escape_sequence.sub("", text).replace("\r\n", "\n")
+    return "\n".join(line.rsplit("\r", 1)[-1] for line in text.split("\n"))
+
+# phrases that make a request about what the last command did, rather than something new. pronouns on their own
+# aren't enough: "compress this folder" mustn't send the last command's output (maybe `cat .env`) along
+followup_phrases = re.compile(r"""\b(
+    (that|this|these|those|its)\s+(error|errors|warning|warnings|output|failure|problem|issue)
+  | (fix|explain)\s+(it|that|this|the\s+error|the\s+errors|the\s+problem)
+  | (it|that|this)\s+(failed|fails|didn't\s+work|doesn't\s+work|did\s+not\s+work|does\s+not\s+work|went\s+wrong)
+  | why\s+did\s+(it|that|this)
+  | what\s+went\s+wrong
+  | (try|do\s+it|run\s+it|run\s+that)\s+again
+  | (last|previous)\s+(command|output|error)
+  | the\s+above
+  | (error|errors|output)\s+above
+)\b""", re.X | re.I)
+
+class LastCommand:
+    """
+        The last command that ran, how it ended and the end of what it printed, so a follow-up request
+        like "fix that error" can show it to the AI. The output is captured by the persistent shell.
+    """
+    def __init__(self):
+        self.command = None
+        self.status = None
+        self.output = None
+        self.full_screen = False  # programs like vim or less draw a screen rather than print output
+        self.captured = False  # a new shell for every command ('shell_mode' subprocess) isn't captured
+
+    def start(self, command):
+        capacity = config.get("output_capture_kb") * 1024
+        if self.output is None or self.output.capacity != capacity:
+            self.output = OutputBuffer(capacity)
+        self.output.clear()
+        self.command = command
+        self.status = None
+        self.full_screen = False
+        # 0 turns capturing off, the AI still gets to see the command and its status
+        self.captured = capacity > 0
+
+    def capture(self, data):
+        if b"\x1b[?1049h" in data:
+            self.full_screen = True
+        self.output.write(data)
+
+    def finish(self, status):
+        self.status = status
+
+    def wanted(self, request):
+        """
+            whether the AI should see this with request, according to the 'output_context' setting
+        """
+        mode = config.get("output_context")
+        if self.command is None or mode == "off":
+            return False
+        return mode == "always" or bool(followup_phrases.search(request))
+
+    def describe(self, budget):
+        """
+            the last command, its exit status and as much of the end of its output as fits in budget tokens
+        """
+        description = f"The last command the user ran was `{self.command}`"
+        if self.status is not None:
+            description += f", it exited with status {self.status}"
+
+        if not self.captured:
+            return description + "."
+        if self.full_screen:
+            return description + ". It was a full screen program, its output isn't shown."
+        if not self.output or not self.output.total:
+            return description + ". It didn't print anything."
+
+        # tokens are about 4 bytes, escape sequences take up some more
+        segments = self.output.tail(budget * 8)
+        cut = self.output.total > sum(len(segment) for segment in segments)
+        lines = clean_output(b"".join(segments).decode(errors="replace")).rstrip("\n").split("\n")
+        if cut:
+            # the first line is probably only the end of one
+            lines = lines[1:]
+
+        shown = []
+        tokens = 0
+        for line in reversed(lines):
+            tokens += estimate_tokens(line)
+            if tokens > budget:
+                cut = True
+                break
+            shown.append(line)
+        shown.reverse()
+
+        return description + f". The end of its output{' (cut off at the start)' if cut else ''}:\n" + "\n".join(shown)
+
+last_command = LastCommand()
+
+def restore_signals():
+    """
+        Python ignores SIGPIPE and SIGXFSZ, and children inherit that. subprocess puts them back for its children,
+        anything started through ptyprocess needs this as its preexec_fn, or `seq 1 1000000 | head -1` fails with a write error
+    """
+    for signal_number in (signal.SIGPIPE, signal.SIGXFSZ):
+        signal.signal(signal_number, signal.SIG_DFL)
+
+class Shell:
     """
-        caches recursive lists in memory so they don't need to keep being re-fetched
+        One long-lived bash that every command runs in, so exports, aliases, functions and the working directory
+        carry over from one command to the next, and no new shell has to start for each command.
+
+        bash runs on a pty so commands still get a real terminal. Commands and their exit status go over two pipes of their own,
+        the terminal only carries what the command itself reads and writes.
     """
+    # {commands} and {results} are the pipe fds. the command doesn't get them, so it can't mix up the protocol
+    script = """
+shopt -s expand_aliases
+# Ctrl+C and Ctrl+Z reach bash as well as the command. bash survives Ctrl+C, so only the command stops.
+# there's no job control to resume a stopped command with, so Ctrl+Z is ignored, by the commands too
+trap : INT
+trap '' TSTP
+__aish_status() {{ return $1; }}
+__aish_last=0
+while IFS= read -r -d '' -u {commands} __aish_dir && IFS= read -r -d '' -u {commands} __aish_cmd; do
+    [ "$PWD" = "$__aish_dir" ] || cd -- "$__aish_dir"
+    __aish_status $__aish_last
+    eval "$__aish_cmd" {commands}<&- {results}>&-
+    __aish_last=$?
+    printf '%s\\0%s\\0' "$__aish_last" "$PWD" >&{results}
+    # the aliases and functions there are now, so aish knows them for commands
+    compgen -a -A function >&{results}
+    printf '\\0' >&{results}
+done
+"""
 
-    if path not in dir_cache:
-        dir_cache[path] = recursive_list(path)
-    return dir_cache[path]
+    def __init__(self):
+        self.process = None
+        self.commands = None  # pipe that bash reads the working directory and command from
+        self.results = None  # pipe that bash writes the exit status and new working directory to
+        self.terminal = None  # bash's side of the pty
+        self.failed = False
+        self.names = frozenset()  # the aliases and functions defined in it, as of the last command
+
+    def enabled(self):
+        return config.get("shell_mode") == "persistent" and not self.failed
+
+    def start(self):
+        import ptyprocess
+
+        bash = shutil.which("bash")
+        if not bash:
+            raise OSError("bash wasn't found")
+
+        commands_read, commands_write = os.pipe()
+        results_read, results_write = os.pipe()
+        os.set_inheritable(commands_read, True)
+        os.set_inheritable(results_write, True)
+        try:
+            self.process = ptyprocess.PtyProcess.spawn(
+                [bash, "--noprofile", "--norc", "-c", self.script.format(commands=commands_read, results=results_write)],
+                env=env_vars,
+                dimensions=self.terminal_size(),
+                pass_fds=(commands_read, results_write),
+                preexec_fn=restore_signals,
+            )
+        finally:
+            os.close(commands_read)
+            os.close(results_write)
+
+        self.commands = commands_write
+        self.results = results_read
+
+        # keys typed while a command runs, that it didn't read, shouldn't end up in the next command's input.
+        # they can only be thrown away from the pty's slave side
+        self.terminal = None
+        try:
+            self.terminal = os.open(os.readlink(f"/proc/{self.process.pid}/fd/0"), os.O_RDWR | os.O_NOCTTY)
+        except OSError:
+            pass
+
+    def stop(self):
+        if self.process:
+            self.process.terminate(force=True)
+            for fd in (self.commands, self.results, self.terminal):
+                if fd is not None:
+                    os.close(fd)
+            self.process = None
+
+    def terminal_size(self):
+        size = shutil.get_terminal_size()
+        return (size.lines, size.columns)
+
+    async def run(self, cmd, capture=None):
+        """
+            runs cmd attached to the terminal, follows it if it changed directory, and returns its exit status.
+            everything it prints is also passed to capture, if given
+        """
+        import select
+        import termios
+        import tty
+
+        if not self.process or not self.process.isalive():
+            self.stop()
+            self.start()
+        self.process.setwinsize(*self.terminal_size())
+
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        received = bytearray()
+        terminal = sys.stdin.fileno() if sys.stdin.isatty() else None
+        sys.stdout.flush()
+
+        def read_results():
+            data = os.read(self.results, 4096)
+            received.extend(data)
+            # bash sends three fields, or closes the pipe when it exits
+            if (not data or received.count(0) >= 3) and not finished.done():
+                finished.set_result(None)
+
+        def read_output():
+            try:
+                data = os.read(self.process.fd, 65536)
+            except OSError:
+                data = b""
+            if data:
+                os.write(sys.stdout.fileno(), data)
+                if capture:
+                    capture(data)
+            else:
+                loop.remove_reader(self.process.fd)
+
+        def read_input():
+            data = os.read(terminal, 1024)
+            if data:
+                os.write(self.process.fd, data)
+
+        os.write(self.commands, f"{os.getcwd()}\0{cmd}\0".encode())
+
+        loop.add_reader(self.results, read_results)
+        loop.add_reader(self.process.fd, read_output)
+        loop.add_signal_handler(signal.SIGWINCH, lambda: self.process.setwinsize(*self.terminal_size()))
+        if terminal is not None:
+            # keys like Ctrl+C go to the command as they are, the pty turns them into signals for it
+            terminal_mode = termios.tcgetattr(terminal)
+            tty.setraw(terminal)
+            loop.add_reader(terminal, read_input)
+        try:
+            await finished
+        finally:
+            loop.remove_reader(self.results)
+            loop.remove_reader(self.process.fd)
+            loop.remove_signal_handler(signal.SIGWINCH)
+            if terminal is not None:
+                loop.remove_reader(terminal)
+                termios.tcsetattr(terminal, termios.TCSADRAIN, terminal_mode)
+
+        # the command is done, but the last of its output may not have been shown yet
+        while select.select([self.process.fd], [], [], 0)[0]:
+            try:
+                data = os.read(self.process.fd, 65536)
+            except OSError:
+                break
+            if not data:
+                break
+            os.write(sys.stdout.fileno(), data)
+            if capture:
+                capture(data)
+
+        if self.terminal is not None:
+            termios.tcflush(self.terminal, termios.TCIFLUSH)
+
+        fields = bytes(received).split(b"\0")
+        if len(fields) < 4:
+            # the command exited the shell itself
+            self.process.wait()
+            status = self.process.exitstatus if self.process.exitstatus is not None else 128 + self.process.signalstatus
+            self.stop()
+            print_color("the shell exited, a new one will start with the next command", colored.Fore.sky_blue_1)
+            return status
+
+        try:
+            os.chdir(fields[1].decode())
+        except OSError:
+            pass
+        self.names = frozenset(name for name in fields[2].decode(errors="replace").split() if not name.startswith("__aish"))
+        return int(fields[0])
+
+shell = Shell()
 
 # --------
 # INITIALIZATION
 
-# disable the Ctrl+C command so that the user can cancel running commands
+# the interactive shell ignores Ctrl+C, so that the user can cancel running commands
 def signal_handler(sig, frame):
     pass
-signal.signal(signal.SIGINT, signal_handler)
+
+# commands that are handled by aish itself
+builtin_commands = ("help", "settings", "config", "connect", "disconnect", "auto", "hide", "cache", "cache stats", "cache clear", "context", "stats", "jobs", "fg", "bg", "exit")
 
 class TabCompleter(prompt_toolkit.completion.Completer):
-    def get_completions(self, document, complete_event):
-        completion_style = "bg:ansiblack fg:ansiwhite"
+    """
+        Completes builtins and executables on PATH in the first word, and paths everywhere.
 
+        Directory listings are cached, and only read again when the directory's mtime changes.
+        They use the entry types scandir gets along with the names, so completing in big or slow (network) folders
+        doesn't need a stat for every entry.
+    """
+    completion_style = "bg:ansiblack fg:ansiwhite"
+    limit = 1000  # most completions shown at once
+    cached_listings = 64
+
+    def __init__(self):
+        self.listings = collections.OrderedDict()  # directory -> (mtime_ns, sorted names, set of folder names)
+
+    def listing(self, directory):
+        mtime = os.stat(directory).st_mtime_ns
+        cached = self.listings.get(directory)
+        if cached and cached[0] == mtime:
+            self.listings.move_to_end(directory)
+            return cached[1], cached[2]
+
+        names = []
+        folders = set()
+        with os.scandir(directory) as folder:
+            for entry in folder:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        folders.add(entry.name)
+                except OSError:
+                    pass
+        names.sort()
+
+        self.listings[directory] = (mtime, names, folders)
+        while len(self.listings) > self.cached_listings:
+            self.listings.popitem(last=False)
+        return names, folders
+
+    def get_completions(self, document, complete_event):
         text = document.text_before_cursor
         words = text.strip().split()
-
-        # List of available commands (case-insensitive)
-        commands = ("help", "settings", "config", "connect", "disconnect", "auto", "hide")
+        # the word that's being completed, nothing yet if the cursor is after a space
+        word = "" if not text or text[-1].isspace() else words[-1]
 
         # Suggest commands if first word is empty or not a path
-        if not words or (len(words) == 1 and not words[0].startswith('.') and not words[0].startswith(os.path.sep)):
-            for cmd in commands:
+        if not words or (len(words) == 1 and word and not word.startswith(('.', os.path.sep, '~'))):
+            for cmd in builtin_commands:
                 if cmd.lower().startswith(text.lower()):
-                    yield prompt_toolkit.completion.Completion(cmd, start_position=-len(text), style=completion_style)
+                    yield prompt_toolkit.completion.Completion(cmd, start_position=-len(text), style=self.completion_style)
 
             if len(words) == 0:
                 return
 
-        # Try to do file completion on the last word
-        base_path = os.getcwd()
-        try:
-            # Determine what we're completing
-            if len(words) > 0:
-                last_word = words[-1]
-            else:
-                last_word = ""
+            for name in path_index.starting_with(word, self.limit):
+                yield prompt_toolkit.completion.Completion(name, start_position=-len(word), style=self.completion_style)
 
-            # If there's no text or only whitespace, suggest current directory
-            if len(text) == 0 or text.isspace():
-                matches = os.listdir(base_path)
-                start_pos = 0
-            else:
-                # Check if the user typed a space after the last word → suggests files in current dir
-                if text.endswith(' '):
-                    # User has typed a space → treat as starting a new filename
-                    matches = os.listdir(base_path)
-                    start_pos = 0
-                else:
-                    # Otherwise, try to glob based on partial path
-                    if last_word.startswith('/') or last_word.startswith('~'):
-                        path_to_search = os.path.expanduser(last_word)
-                    else:
-                        path_to_search = os.path.join(base_path, last_word)
+        # complete the last part of the path in the word, in the folder the rest of it points to
+        folder, prefix = os.path.split(word)
+        try:
+            names, folders = self.listing(os.path.join(os.getcwd(), os.path.expanduser(folder)))
+        except OSError:
+            return
+
+        # hidden files only show up when asked for, like in other shells
+        shown = 0
+        for name in names_starting_with(names, prefix):
+            if name.startswith('.') and not prefix.startswith('.'):
+                continue
+            yield prompt_toolkit.completion.Completion(
+                name + "/" if name in folders else name,
+                start_position=-len(prefix),
+                style=self.completion_style
+            )
+            shown += 1
+            if shown >= self.limit:
+                break
+
+def common_prefix_length(a, b):
+    """
+        how many characters a and b have in common at the start. compares halves instead of characters, so it's fast on long strings
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
 
-                    matches = []
-                    pattern = f"{path_to_search}*"
-                    for f in glob.glob(pattern):
-                        if os.path.isdir(f) or os.path.isfile(f):
-                            # Show only basename if it's in current directory
-                            if os.path.dirname(f) == base_path:
-                                f = os.path.basename(f)
+def common_suffix_length(a, b):
+    """
+        how many characters a and b have in common at the end
+    """
+    return common_prefix_length(a[::-1], b[::-1])
 
-                            matches.append(f.replace(os.path.expanduser("~"), "~"))
+class Highlighter(prompt_toolkit.lexers.Lexer):
+    """
+        Colors the input while it's typed: shell commands with pygments' bash lexer, and requests for the AI in a style
+        of their own with their @ targets marked. is_shell_command tells them apart, the way the fast path does.
 
-                    start_pos = -len(last_word)
+        pygments is loaded in the background once the prompt is up. Lexing is incremental: the tokens of the last input are kept
+        with checkpoints of the lexer's state, so after an edit only the text from the last checkpoint before it is lexed again,
+        and lexing stops as soon as it's back in step with the old tokens behind the edit. Lines are slices of the token list.
+    """
+    checkpoint_distance = 32  # characters between checkpoints, at least
 
-            # add trailing slash to directories
-            for index, match in enumerate(matches):
-                if os.path.isdir(match):
-                    matches[index] = match+"/"
+    def __init__(self):
+        self.lexer = None
+        self.loading = None
+        self.styles = {}  # pygments token type -> style
+        self.matches = 0  # rules the lexer matched so far
+        self.emitted = 0  # tokens it made out of those matches
+        self.transitions = []  # state changes of those matches that haven't been followed yet
+        self.text = ""
+        self.tokens = []  # (style, text) with every newline in a token of its own
+        self.checkpoints = [(0, 0, ("root",))]  # (position, token index, lexer state stack) where lexing can start again
+        self.line_starts = [0]  # index of the first token of every line
 
-            # Yield all matching completions
-            for match in matches:
-                yield prompt_toolkit.completion.Completion(match, start_position=start_pos, style=completion_style)
-        
-        except Exception as e:
-            pass
+    def load(self):
+        """
+            prepares a bash lexer that reports every state change, so its state is known between tokens
+        """
+        import pygments.token
+        from pygments.lexers.shell import BashLexer
+        token_type = type(pygments.token.Token)
+
+        def tracked(action, new_state):
+            def callback(lexer, match):
+                if type(action) is token_type:
+                    self.emitted += 1
+                    yield match.start(), action, match.group()
+                elif action is not None:
+                    for token in action(lexer, match):
+                        self.emitted += 1
+                        yield token
+                self.matches += 1
+                self.transitions.append(new_state)
+            return callback
+
+        lexer = BashLexer()
+        lexer._tokens = {
+            state: [(rexmatch, tracked(action, new_state), new_state) for rexmatch, action, new_state in rules]
+            for state, rules in lexer._tokens.items()
+        }
+        self.lexer = lexer
+
+    def start_loading(self):
+        if self.loading is None:
+            self.loading = asyncio.get_running_loop().run_in_executor(None, self.load)
+            self.loading.add_done_callback(self.loaded)
+
+    def loaded(self, future):
+        if future.exception() is None:
+            prompt_toolkit.application.get_app().invalidate()
+
+    def invalidation_hash(self):
+        # the prompt caches lines by this and the text, they look different once pygments is loaded
+        return (id(self), self.lexer is not None)
+
+    def style(self, token_type):
+        if token_type not in self.styles:
+            from prompt_toolkit.styles.pygments import pygments_token_to_classname
+            self.styles[token_type] = "class:" + pygments_token_to_classname(token_type)
+        return self.styles[token_type]
+
+    @staticmethod
+    def follow(stack, new_state):
+        """
+            changes stack the way pygments' RegexLexer does after a match
+        """
+        if isinstance(new_state, tuple):
+            for state in new_state:
+                if state == "#pop":
+                    if len(stack) > 1:
+                        stack.pop()
+                elif state == "#push":
+                    stack.append(stack[-1])
+                else:
+                    stack.append(state)
+        elif isinstance(new_state, int):
+            if abs(new_state) >= len(stack):
+                del stack[1:]
+            else:
+                del stack[new_state:]
+        elif new_state == "#push":
+            stack.append(stack[-1])
+
+    def relex(self, text):
+        """
+            updates the tokens for text, from where it's different from the last text
+        """
+        old_text = self.text
+        prefix = common_prefix_length(old_text, text)
+        suffix = common_suffix_length(old_text[prefix:], text[prefix:])
+        shift = len(text) - len(old_text)
+        edit_end = len(text) - suffix
+
+        # start again at the last checkpoint before the edit
+        index = max(bisect.bisect_left(self.checkpoints, prefix, key=lambda checkpoint: checkpoint[0]) - 1, 0)
+        start, token_index, stack = self.checkpoints[index]
+        tokens = self.tokens[:token_index]
+        checkpoints = self.checkpoints[:index + 1]
+        # checkpoints behind the edit. if the lexer's state is the same at one of them, the tokens from there on are too
+        ahead = {position + shift: number for number, (position, _, _) in enumerate(self.checkpoints) if position >= len(old_text) - suffix}
+
+        stack = list(stack)
+        self.transitions.clear()
+        matches = self.matches
+        emitted = self.emitted
+        fallback = False
+        whitespace = False
+        previous = ""
+        # an unclosed quote or comment, or any heredoc, is lexed differently once the text after it changes,
+        # so there can't be any checkpoints after one
+        unfinished = False
+        generator = self.lexer.get_tokens_unprocessed(text[start:], stack=tuple(stack))
+        try:
+            for position, token_type, value in generator:
+                position += start
+                for new_state in self.transitions:
+                    self.follow(stack, new_state)
+                self.transitions.clear()
+
+                # pygments only emits tokens of its own when no rule matches, and those always end a match
+                if whitespace and not unfinished and (self.matches != matches or fallback):
+                    number = ahead.get(position)
+                    if number is not None and position >= edit_end and self.checkpoints[number][2] == tuple(stack):
+                        # back in step, the rest is the old tokens
+                        old_index = self.checkpoints[number][1]
+                        offset = len(tokens) - old_index
+                        tokens.extend(self.tokens[old_index:])
+                        checkpoints.extend((old_position + shift, old_token_index + offset, state) for old_position, old_token_index, state in self.checkpoints[number:])
+                        break
+                    # a checkpoint at #! would make it look like the start of a script to the lexer
+                    if position - checkpoints[-1][0] >= self.checkpoint_distance and not value.startswith("#"):
+                        checkpoints.append((position, len(tokens), tuple(stack)))
+
+                fallback = self.emitted == emitted
+                matches = self.matches
+                emitted = self.emitted
+                if fallback and value == "\n":
+                    # pygments starts over in the root state after a newline no rule matched
+                    stack = ["root"]
+                elif fallback or value == previous == "<" or (value.startswith("<<") and value != "<<<") or (value.startswith("#") and not value.endswith("\n")):
+                    unfinished = True
+                previous = value
+
+                style = self.style(token_type)
+                if "\n" in value:
+                    tokens.extend((style, part) for part in re.split("(\n)", value) if part)
+                else:
+                    tokens.append((style, value))
+                whitespace = value.isspace()
+        finally:
+            generator.close()
+
+        self.text = text
+        self.tokens = tokens
+        self.checkpoints = checkpoints
+        self.line_starts = [0] + [number + 1 for number, (_, value) in enumerate(tokens) if value == "\n"]
+
+    def lex_document(self, document):
+        lines = document.lines
+
+        def plain(number):
+            return [("", lines[number])] if number < len(lines) else []
+
+        if not config.get("highlighting"):
+            return plain
+        self.start_loading()
+
+        text = document.text
+        mode = config.get("fast_path") if config.get("fast_path") in ("safe", "aggressive") else "safe"
+        if text.strip() and not is_shell_command(text, mode, quick=True):
+            def request(number):
+                if number >= len(lines):
+                    return []
+                return [("class:target" if part.startswith("@") else "class:request", part) for part in re.split(r"(@\S+)", lines[number]) if part]
+            return request
+
+        if self.lexer is None:
+            return plain
+        if text != self.text:
+            self.relex(text)
+
+        tokens = self.tokens
+        line_starts = self.line_starts
+
+        def command(number):
+            if number >= len(line_starts):
+                return []
+            # leave out the newline at the end of the line
+            end = line_starts[number + 1] - 1 if number + 1 < len(line_starts) else len(tokens)
+            return tokens[line_starts[number]:end]
+        return command
 
 class Config:
     path = f"{os.path.expanduser('~')}/.aish.conf"
@@ -222,8 +2590,44 @@ class Config:
         "api_url": "http://localhost:12434/v1",
         "api_key": "key_here",
         "api_model": "qwen3",
+        "api_max_tokens": 1024,
+        "api_stop": [],
         "autoconnect": True,
+        "connect_timeout": 5,
+        "api_timeout": 60,
+        "api_endpoints": [],
+        "api_hedge": True,
         "show_intro": True,
+        "fast_path": "safe",
+        "trace_file": "",
+        "examples_count": 3,
+        "examples_direct_threshold": 0.95,
+        "history_max_entries": 100000,
+        "history_max_age_days": 0,
+        "history_load_limit": 10000,
+        "shell_mode": "persistent",
+        "batch_jobs": 4,
+        "job_output_kb": 64,
+        "highlighting": True,
+        "speculative": False,
+        "speculative_delay": 0.4,
+        "speculative_max_requests": 2,
+        "response_cache": True,
+        "response_cache_ttl_hours": 168,
+        "response_cache_max_entries": 5000,
+        "target_max_depth": 5,
+        "target_ignore": [".git", "node_modules", "__pycache__", ".venv", "venv", ".tox", ".mypy_cache", ".cache", "build", "dist", "target"],
+        "target_gitignore": True,
+        "target_skip_fs_types": ["nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "9p", "afs"],
+        "target_time_budget": 1.0,
+        "target_max_entries": 200000,
+        "target_cache_memory_mb": 64,
+        "target_max_results": 20,
+        "target_token_budget": 1000,
+        "listing_token_budget": 800,
+        "output_context": "auto",
+        "output_capture_kb": 256,
+        "output_token_budget": 600,
         "intro": f"Welcome to AI.sh! type 'help' for help. Type 'settings' to edit the configuration file. Use 'auto' to engage automatic mode.\nThe AI.sh configuration file is here: {path}\nPlease edit the configuration file to suit your preferences, and to set up the AI connection!",
         "prompt": """
 You are AI.sh, an AI shell assistant. You live in a linux shell, helping the user convert natural language into CLI commands.
@@ -262,6 +2666,12 @@ ALWAYS answer with a command. Prefer commands over natural language statements.
             print_color(f"warning: config wasn't loaded (error: {e}).\ndefaulting to default settings.", colored.Fore.red)
             self.data = self.default_data
 
+    def get(self, key):
+        """
+            returns a setting, falling back to its default for config files written before it existed
+        """
+        return self.data.get(key, self.default_data.get(key))
+
     def launch_editor(self):
         while True:
             os.system(f"{os.environ.get('EDITOR', 'nano')} {self.path}")
@@ -275,13 +2685,13 @@ ALWAYS answer with a command. Prefer commands over natural language statements.
                 print("Your config isn't valid. Press Enter to go back into the editor and edit it again!")
                 input()
 
-# load config
+# the settings are loaded when aish starts, see cli()
 config = Config()
-config.load()
 
 using_ai = False
 auto = False
 hide_cmd = False
+session = None  # the prompt of the interactive shell, see create_session()
 
 # get most important env variables
 env_vars_to_pass_on = (
@@ -301,277 +2711,1145 @@ for key, value in os.environ.items():
     if key in env_vars_to_pass_on:
         env_vars_display[key] = value
 
-sys_info = {
-    "os": platform.system(),
-    "os_release": platform.release(),
-    "platform": platform.platform(),
-    "architecture": platform.machine() if platform.machine() else "unknown",
-    "hostname": platform.node(),
-    "system_root": os.listdir("/"),
-}
+@functools.cache
+def get_sys_info():
+    """
+        information about the system for the AI. only gathered when it's first needed, since it's slow
+    """
+    import platform
+    return {
+        "os": platform.system(),
+        "os_release": platform.release(),
+        "platform": platform.platform(),
+        "architecture": platform.machine() if platform.machine() else "unknown",
+        "hostname": platform.node(),
+        "system_root": os.listdir("/"),
+    }
 
 # -------------
 # MAIN PROGRAM
-client = None
-
-if config.data.get("show_intro"):
-    print_color(config.data.get("intro"), colored.Fore.yellow)
-
-skip_ai_connect = False
-if config.first_run:
-    config.write_defaults()
-    if prompt_toolkit.shortcuts.confirm("Would you like to set up the configuration now?"):
-        config.launch_editor()
-    else:
-        print("Okay. You can launch the editor at any time by typing 'settings' or 'config'.")
-        print("Once you've set things up, type 'connect' to connect to the AI.")
-        skip_ai_connect = True
-
-if not skip_ai_connect and config.data.get("autoconnect"):
-    client = ai_connect(config)
-    if client:
-        using_ai = True
 
 prompt_style = prompt_toolkit.styles.Style.from_dict({
     'connected': 'fg:ansigreen',
+    'connecting': 'fg:ansiyellow',
     'disconnected': 'fg:skyblue',
     'reset': 'fg:default',
+    # what's typed, when it's a request for the AI rather than a command
+    'request': 'fg:ansicyan',
+    'target': 'fg:ansiyellow',
 })
 
-session = prompt_toolkit.PromptSession(
-    completer=prompt_toolkit.completion.ThreadedCompleter(
-        TabCompleter()
-    ),
-    history=prompt_toolkit.history.FileHistory(os.path.expanduser("~/.aish_history")),
-    auto_suggest=prompt_toolkit.auto_suggest.AutoSuggestFromHistory(),
-    style=prompt_style,
-    complete_style=prompt_toolkit.shortcuts.CompleteStyle.COLUMN,
-    complete_while_typing=False
-)
+def create_session():
+    """
+        the interactive prompt, with tab completion, history and suggestions from it
+    """
+    session = prompt_toolkit.PromptSession(
+        completer=prompt_toolkit.completion.ThreadedCompleter(
+            TabCompleter()
+        ),
+        history=prompt_toolkit.history.ThreadedHistory(command_history),
+        auto_suggest=HistorySuggestion(command_history),
+        lexer=Highlighter(),
+        style=prompt_style,
+        complete_style=prompt_toolkit.shortcuts.CompleteStyle.COLUMN,
+        complete_while_typing=False
+    )
+
+    # redraw the prompt when a background connection check finishes
+    connection.on_change = session.app.invalidate
+    session.default_buffer.on_text_changed += speculation.on_text_changed
+    return session
 
 env_vars = os.environ.copy()
 
-while True:
+def shell_prompt():
+    path_display = os.getcwd().replace(os.path.expanduser("~"), "~")
+
+    match connection.status:
+        case "connected":
+            display_name = "<connected>AI.sh</connected>"
+        case "connecting":
+            display_name = "<connecting>AI.sh</connecting>"
+        case _:
+            display_name = "<disconnected>sh</disconnected>"
+
+    return prompt_toolkit.formatted_text.HTML(
+        f"{display_name} ({path_display})> "
+    )
+
+async def confirm_async(message):
+    # messages can be colored with escape codes
+    return await prompt_toolkit.shortcuts.create_confirm_session(prompt_toolkit.formatted_text.ANSI(message)).prompt_async()
+
+async def run_cancellable(coroutine):
+    """
+        runs coroutine until it's done or Ctrl+C is pressed. returns its result, or None if it was cancelled
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coroutine)
+    loop.add_signal_handler(signal.SIGINT, task.cancel)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+        print_color("\ncancelled", colored.Fore.sky_blue_1)
+        return None
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        signal.signal(signal.SIGINT, signal_handler)
+
+async def generate(prompt, show=True):
+    """
+        streams the AI's answer to prompt and returns the command in it.
+        the HTTP stream is closed as soon as the command is complete, or when this is cancelled
+    """
+    # only send limits that are set, some servers reject empty ones
+    limits = {}
+    if config.get("api_max_tokens"):
+        limits["max_tokens"] = config.get("api_max_tokens")
+    if config.get("api_stop"):
+        limits["stop"] = config.get("api_stop")
+
+    stats.count("prompt_tokens", sum(estimate_tokens(message["content"]) for message in prompt))
+    start = time.perf_counter()
+    endpoint, stream, read, opened = await connection.open_stream(config, prompt, limits)
+    stats.add("request", opened - start)
+    stats.note("endpoint", endpoint.url)
+
+    # stream llm's response, and stop reading as soon as the command is complete
+    command_stream = CommandStream()
+    read = collections.deque(read)
+    first_token = None
+    tokens = 0  # servers send about one token per chunk
     try:
-        path_display = os.getcwd().replace(os.path.expanduser("~"), "~")
+        if show:
+            print(f"{colored.Fore.sky_blue_1}>> ", end="", flush=True)
+        while not command_stream.done:
+            if read:
+                # what was read while the servers raced for the first token
+                chunk = read.popleft()
+            else:
+                try:
+                    # a server that stops sending shouldn't hang the shell
+                    chunk = await asyncio.wait_for(anext(stream), config.get("api_timeout"))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"the AI didn't send anything for {config.get('api_timeout')} seconds")
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+
+            tokens += 1
+            if first_token is None:
+                first_token = time.perf_counter()
+                stats.add("first_token", first_token - start)
+
+            chunk_s = command_stream.feed(chunk.choices[0].delta.content)
+            if chunk_s and show:
+                print(chunk_s, end="", flush=True)
+    except Exception as e:
+        # a server that breaks off in the middle of an answer is skipped for a while too
+        endpoint.down(e)
+        raise
+    finally:
+        if show:
+            print(colored.Style.reset)
+        await stream.close()
+
+        stats.count("completion_tokens", tokens)
+        if first_token is not None:
+            streaming = time.perf_counter() - first_token
+            stats.add("stream", streaming)
+            if tokens > 1 and streaming > 0:
+                stats.token_rates.append((tokens - 1) / streaming)
+
+    return command_stream.result()
+
+class Speculation:
+    """
+        Asks the AI about the input while it's still being typed, turned on with the 'speculative' setting.
+
+        After a short pause in typing, the current text is sent in the background. Changing the text cancels that request,
+        and when enter is pressed on exactly the text that was sent, its answer is used without waiting for a new one.
+    """
+    def __init__(self):
+        self.requests = {}  # text -> (cache key, task)
+        self.waiting = None  # task that waits for typing to pause, then starts a request
+        self.started = 0
+        self.hits = 0
+        self.wasted = 0
+
+    def on_text_changed(self, buffer):
+        if self.waiting:
+            self.waiting.cancel()
+            self.waiting = None
+        self.cancel()
+
+        if config.get("speculative") and buffer.text.strip():
+            self.waiting = asyncio.ensure_future(self.start(buffer.text))
+
+    def worth_asking(self, text):
+        """
+            only natural language requests go to the AI. builtins and shell commands never do, and @ targets need the user
+        """
+        text = text.strip()
+        return (
+            connection.status == "connected"
+            and len(text.split()) > 1
+            and "@" not in text
+            and text not in builtin_commands
+            and not is_shell_command(text, config.get("fast_path"))
+        )
+
+    async def start(self, text):
+        await asyncio.sleep(config.get("speculative_delay"))
+        # the syntax check starts bash, so it runs off the event loop
+        worth_asking = await asyncio.to_thread(self.worth_asking, text)
+        self.waiting = None
+        if text in self.requests or not worth_asking:
+            return
+        # requests for older text that are still closing count towards the limit
+        if sum(not task.done() for _, task in self.requests.values()) >= config.get("speculative_max_requests"):
+            return
+
+        context = Context(text)
+        task = asyncio.ensure_future(generate(context.messages(), show=False))
+        # failures are dealt with when the answer is needed, if it ever is
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self.requests[text] = (context.cache_key(config.data.get("api_model")), task)
+        self.started += 1
+
+    def cancel(self):
+        """
+            drops every speculative request, their answers aren't going to be used
+        """
+        for _, task in self.requests.values():
+            task.cancel()
+        self.wasted += len(self.requests)
+        self.requests.clear()
+
+    def take(self, text, cache_key):
+        """
+            returns the task that's answering text, if there is one that was asked with the same context. every other request is dropped
+        """
+        request = self.requests.pop(text, None)
+        self.cancel()
+        if not request:
+            return None
+        if request[0] != cache_key:
+            # the folder or targets changed since it was asked
+            request[1].cancel()
+            self.wasted += 1
+            return None
+
+        self.hits += 1
+        return request[1]
+
+speculation = Speculation()
+
+async def run_command(cmd, background=False):
+    """
+        runs a shell command attached to the terminal, and returns its exit status.
+        in the background, or if it ends with &, it's started as a job instead and None is returned
+    """
+    cmd, ends_with_ampersand = split_background(cmd)
+    if background or ends_with_ampersand:
+        try:
+            jobs.start(cmd)
+        except OSError as e:
+            print_color(f"the job couldn't be started (error: {e})", colored.Fore.red)
+        return None
+
+    start = time.monotonic()
+    status = None
+    last_command.start(cmd)
+    if shell.enabled():
+        try:
+            status = await shell.run(cmd, last_command.capture)
+        except (OSError, ImportError) as e:
+            print_color(f"the persistent shell couldn't be started, running every command in a new shell from now on (error: {e})", colored.Fore.red)
+            shell.failed = True
+            shell.stop()
+
+    if status is None:
+        last_command.captured = False
+        process = await asyncio.create_subprocess_shell(cmd, env=env_vars)
+        status = await process.wait()
+
+    duration = time.monotonic() - start
+    last_command.finish(status)
+    stats.add("command", duration)
+    stats.note("status", status)
+    command_history.record(cmd, status, duration)
+    return status
+
+# a trailing & that puts the command in the background, not part of && or a redirect like >&
+background_marker = re.compile(r"(?<![&|>\\])&\s*$")
+
+def split_background(cmd):
+    """
+        returns (cmd without a trailing &, whether it had one)
+    """
+    match = background_marker.search(cmd)
+    if not match:
+        return cmd, False
+    return cmd[:match.start()].rstrip(), True
+
+class Job:
+    """
+        A command running in the background. It gets a pty of its own, so it still sees a terminal (colors,
+        line buffered output), and is the leader of its own process group, so signals reach everything it started.
 
-        display_name = "<connected>AI.sh</connected>" if using_ai else "<disconnected>sh</disconnected>"
-        shell_prompt = prompt_toolkit.formatted_text.HTML(
-            f"{display_name} ({path_display})> "
+        Its output is always read, into a ring buffer of 'job_output_kb', so a chatty job never blocks on a full pty
+        and never takes more memory than that. fg shows what it printed since it was last in the foreground.
+    """
+    def __init__(self, number, cmd):
+        import ptyprocess
+
+        self.number = number
+        self.command = cmd
+        self.start_time = time.monotonic()
+        # more input is stored while the job runs, its command and status belong with the input that started it
+        self.history_entry = command_history.current
+        self.output = OutputBuffer(config.get("job_output_kb") * 1024)
+        self.shown = 0  # bytes of output that were shown in the foreground
+        self.state = "running"
+        self.status = None
+        self.foreground = False
+        self.finished = asyncio.get_running_loop().create_future()
+        self.process = ptyprocess.PtyProcess.spawn(
+            [shutil.which("bash") or "/bin/sh", "-c", cmd],
+            cwd=os.getcwd(),
+            env=env_vars,
+            dimensions=shell.terminal_size(),
+            preexec_fn=restore_signals,
         )
+        asyncio.get_running_loop().add_reader(self.process.fd, self.read)
+
+    def read(self):
+        try:
+            data = os.read(self.process.fd, 65536)
+        except OSError:
+            data = b""
+        if not data:
+            # everything that had the pty open is gone
+            asyncio.get_running_loop().remove_reader(self.process.fd)
+            asyncio.ensure_future(self.reap())
+            return
+
+        self.output.write(data)
+        if self.foreground:
+            os.write(sys.stdout.fileno(), data)
+            self.shown = self.output.total
+
+    async def reap(self):
+        while self.process.isalive():
+            await asyncio.sleep(0.05)
+        self.finish()
+
+    def poll(self):
+        """
+            notices a job that exited while something it started still has its pty open
+        """
+        if self.state != "done" and not self.process.isalive():
+            asyncio.get_running_loop().remove_reader(self.process.fd)
+            self.finish()
+
+    def finish(self):
+        if self.state == "done":
+            return
+        self.state = "done"
+        self.status = self.process.exitstatus if self.process.exitstatus is not None else 128 + (self.process.signalstatus or 0)
+        # ptyprocess's close() sleeps to give the child time to exit, this one was already reaped
+        self.process.fileobj.close()
+        self.process.closed = True
+        command_history.record(self.command, self.status, time.monotonic() - self.start_time, self.history_entry)
+        self.finished.set_result(self.status)
+        jobs.finished(self)
+
+    def signal(self, signal_number):
+        try:
+            os.killpg(self.process.pid, signal_number)
+        except ProcessLookupError:
+            pass
+
+    def stop(self):
+        # the job's process group is orphaned (it leads a session of its own), the kernel drops SIGTSTP for those
+        self.signal(signal.SIGSTOP)
+        self.state = "stopped"
+
+    def resume(self):
+        self.signal(signal.SIGCONT)
+        self.state = "running"
+
+    def unseen(self):
+        """
+            how many bytes it printed that weren't shown yet, including ones the buffer no longer holds
+        """
+        return self.output.total - self.shown
+
+    def describe(self):
+        state = {"running": "Running", "stopped": "Stopped"}.get(self.state, "Done" if not self.status else f"Exit {self.status}")
+        output = f"  ({format_size(self.unseen())} of new output)" if self.unseen() else ""
+        return f"[{self.number}] {self.process.pid:<8} {state:<8} {self.command}{output}"
+
+    async def bring_to_foreground(self):
+        """
+            shows what it printed so far, then attaches it to the terminal until it exits, or Ctrl+Z stops it again.
+            returns its exit status, or None if it was stopped
+        """
+        import termios
+        import tty
+
+        unseen = self.unseen()
+        if unseen > len(self.output):
+            print_color(f"[{format_size(unseen - len(self.output))} of earlier output wasn't kept]", colored.Fore.sky_blue_1)
+        sys.stdout.flush()
+        for segment in self.output.tail(unseen):
+            os.write(sys.stdout.fileno(), segment)
+        self.shown = self.output.total
+
+        if self.state == "done":
+            jobs.remove(self)
+            return self.status
+        if self.state == "stopped":
+            self.resume()
+
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+        terminal = sys.stdin.fileno() if sys.stdin.isatty() else None
+
+        def read_input():
+            data = os.read(terminal, 1024)
+            # Ctrl+C goes through the job's pty, that makes it a signal. Ctrl+Z stops the job instead of aish
+            if b"\x1a" in data:
+                self.stop()
+                if not stopped.done():
+                    stopped.set_result(None)
+            elif data:
+                os.write(self.process.fd, data)
+
+        self.process.setwinsize(*shell.terminal_size())
+        self.foreground = True
+        loop.add_signal_handler(signal.SIGWINCH, lambda: self.process.setwinsize(*shell.terminal_size()))
+        if terminal is not None:
+            terminal_mode = termios.tcgetattr(terminal)
+            tty.setraw(terminal)
+            loop.add_reader(terminal, read_input)
+        try:
+            await asyncio.wait((self.finished, stopped), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.foreground = False
+            loop.remove_signal_handler(signal.SIGWINCH)
+            if terminal is not None:
+                loop.remove_reader(terminal)
+                termios.tcsetattr(terminal, termios.TCSADRAIN, terminal_mode)
+
+        if self.state == "stopped":
+            print_color(f"\n{self.describe()}", colored.Fore.sky_blue_1)
+            return None
+        jobs.remove(self)
+        return self.status
+
+class Jobs:
+    """
+        The background jobs, numbered like bash numbers them. Finished jobs are announced at the prompt.
+        The ones that printed something nobody saw yet are kept until fg shows it.
+    """
+    keep_finished = 20  # finished jobs with unseen output that are kept, the oldest ones go first
+
+    def __init__(self):
+        self.jobs = {}  # number -> Job
+        self.announcements = []  # about jobs that finished while there was no prompt to show them at
+        self.warned = False
+
+    def start(self, cmd):
+        number = max(self.jobs, default=0) + 1
+        job = Job(number, cmd)
+        self.jobs[number] = job
+        self.warned = False
+        print_color(f"[{number}] {job.process.pid}", colored.Fore.sky_blue_1)
+        return job
+
+    def remove(self, job):
+        self.jobs.pop(job.number, None)
+
+    def finished(self, job):
+        if job.foreground:
+            return
+        message = job.describe() + ("  'fg' shows it" if job.unseen() else "")
+        if not job.unseen():
+            self.remove(job)
+
+        finished = [other for other in self.jobs.values() if other.state == "done"]
+        for other in finished[:-self.keep_finished]:
+            self.remove(other)
+
+        app = prompt_toolkit.application.get_app_or_none()
+        if app and app.is_running:
+            prompt_toolkit.application.run_in_terminal(lambda: print_color(message, colored.Fore.sky_blue_1))
+        else:
+            self.announcements.append(message)
+
+    def announce(self):
+        """
+            prints what finished while a command had the terminal
+        """
+        for message in self.announcements:
+            print_color(message, colored.Fore.sky_blue_1)
+        self.announcements.clear()
+
+    def running(self):
+        for job in list(self.jobs.values()):
+            job.poll()
+        return [job for job in self.jobs.values() if job.state != "done"]
+
+    def find(self, reference):
+        """
+            the job for '%2', '2', or the most recent one for nothing. prints why if there isn't one
+        """
+        if not reference:
+            if self.jobs:
+                return self.jobs[max(self.jobs)]
+            print("no jobs")
+            return None
+
+        job = self.jobs.get(int(reference.lstrip("%"))) if reference.lstrip("%").isdigit() else None
+        if not job:
+            print(f"{reference}: no such job")
+        return job
+
+    def show(self):
+        for job in list(self.running()) + [job for job in self.jobs.values() if job.state == "done"]:
+            print(job.describe())
+            if job.state == "done" and not job.unseen():
+                self.remove(job)
+
+    def kill(self, args):
+        """
+            kill [-SIGNAL] %n ...: signals the process group of each job, SIGTERM by default
+        """
+        signal_number = signal.SIGTERM
+        if args and args[0].startswith("-"):
+            name = args.pop(0)[1:].upper()
+            try:
+                signal_number = int(name) if name.isdigit() else signal.Signals[name if name.startswith("SIG") else "SIG" + name]
+            except (KeyError, ValueError):
+                print(f"kill: {name}: invalid signal")
+                return
+
+        for reference in args:
+            job = self.find(reference)
+            if job and job.state == "done":
+                print(f"{reference}: the job has already finished")
+            elif job:
+                job.signal(signal_number)
+                # a stopped job only handles the signal once it runs again
+                if job.state == "stopped":
+                    job.resume()
+
+    def hang_up(self):
+        """
+            like closing a terminal: every job that's still running gets SIGHUP
+        """
+        for job in self.running():
+            job.signal(signal.SIGHUP)
+            job.signal(signal.SIGCONT)
+
+jobs = Jobs()
+
+# --------
+# TRANSLATION
+
+# words that make a command potentially destructive, so it needs an extra confirmation
+unsafe_words = (
+    "rm", "del", "delete", "-delete", "--delete", "remove", "-r", "-rf", "dd", "wipe", "shred", "mkfs", "format", "fdisk", "parted",
+    "sh", "bash", "zsh", "csh", "fish", "reboot", "shutdown", "poweroff", "halt",
+)
+
+def is_unsafe(cmd):
+    return any(word.lower() in unsafe_words for word in cmd.split(" "))
+
+def is_root(cmd):
+    return cmd.split(" ")[0].lower() in ("sudo", "su")
 
-        #cmd = session.prompt(shell_prompt, lexer=prompt_toolkit.lexers.PygmentsLexer(BashLexer))
-        # lexer disabled for now
-        cmd = session.prompt(shell_prompt)
-        cmd_split = cmd.split(" ")
-
-        match cmd:
-            case "exit":
-                sys.exit()
-            case "auto":
-                if not auto:
-                    if confirm(f"{colored.Fore.red}Warning: automatic mode will run the AI's suggested commands without your confirmation! Are you sure{colored.Style.reset}"):
+class Translation:
+    """
+        The answer to one request: the command, where it came from and what the safety check found in it.
+
+        source is "shell" for input that already was a command, or "cache", "example", "speculation" or "ai".
+        note says where a reused answer came from, to show next to it. command is empty if the AI didn't answer with one.
+    """
+    def __init__(self, request, command, source, cache_key=None, relevant_paths=(), note=None):
+        self.request = request
+        self.command = command
+        self.source = source
+        self.cache_key = cache_key
+        self.relevant_paths = list(relevant_paths)
+        self.note = note
+        self.unsafe = is_unsafe(command)
+        self.root = is_root(command)
+
+    def accept(self):
+        """
+            remembers the command as the answer to the request, once the user has agreed to run it
+        """
+        if config.get("response_cache") and self.cache_key:
+            response_cache.put(self.cache_key, self.request, config.get("api_model"), self.command)
+        examples.add(self.request, self.command)
+        mark_used_targets(self.command, self.relevant_paths)
+
+    def record(self):
+        return {"request": self.request, "command": self.command, "source": self.source, "unsafe": self.unsafe, "root": self.root}
+
+def scan_targets(show=True):
+    """
+        returns the file index of the current folder to search @ targets in
+    """
+    with stats.timer("target_scan"):
+        file_index = get_file_index(os.getcwd())
+
+    if show:
+        if not file_index.complete:
+            print_color("(directory scan ran out of time, not every path was searched yet)", colored.Fore.yellow)
+        for path, error in file_index.walker.errors[:3]:
+            print_color(f"couldn't scan {path}: {error.strerror}", colored.Fore.red)
+    return file_index
+
+def search_target(file_index, word):
+    """
+        returns (the best paths for an @ target, how many matched in total)
+    """
+    with stats.timer("target_search"):
+        return file_index.search(word[1:], config.get("target_max_results"))
+
+def describe_matches(found_items, total):
+    return f"best {len(found_items)} of {total} matches" if total > len(found_items) else f"{total} matches"
+
+async def choose_targets(cmd):
+    """
+        lets the user pick a path for every @ target in cmd, for when there's no AI to do it.
+        returns cmd with the targets replaced, or None if nothing was found for any of them
+    """
+    cmd_split = cmd.split(" ")
+    file_index = None
+    found_any = False
+    for index, word in enumerate(cmd_split):
+        if not word.startswith("@"):
+            continue
+
+        print(f"{colored.Fore.sky_blue_1}>> targeting {word[1:]}{colored.Style.reset}")
+        if not file_index:
+            file_index = scan_targets()
+
+        found_items, total = search_target(file_index, word)
+        if not found_items:
+            print(f"No paths found for {word}")
+            continue
+
+        found_any = True
+        cmd_split[index] = await prompt_toolkit.shortcuts.choice_input.ChoiceInput(
+            message=f"Please choose a target for {word} ({describe_matches(found_items, total)}):",
+            options=[(choice, choice) for choice in found_items],
+            default=word
+        ).prompt_async()
+        recent_targets.mark([cmd_split[index]])
+
+    if file_index and not found_any:
+        print("No files or folders found")
+        return None
+    return " ".join(cmd_split)
+
+async def translate(request, show=False):
+    """
+        turns a request into a command. @ targets are looked up, then the response cache, earlier accepted commands,
+        speculation and the AI are asked in that order. with show, progress and the AI's answer are printed as they come.
+        returns a Translation, and raises LookupError if none of the @ targets were found
+    """
+    # give the AI as many of the best paths for each @ target as fit in the token budget
+    file_index = None
+    relevant_paths = []
+    target_lines = []
+    for word in request.split(" "):
+        if not word.startswith("@"):
+            continue
+
+        if show:
+            print(f"{colored.Fore.sky_blue_1}>> targeting {word[1:]}{colored.Style.reset}")
+        if not file_index:
+            file_index = scan_targets(show)
+
+        found_items, total = search_target(file_index, word)
+        relevant_paths.extend(found_items)
+        if not found_items:
+            if show:
+                print(f"No paths found for {word}")
+            continue
+
+        budget = config.get("target_token_budget") - estimate_tokens("\n".join(target_lines))
+        paths_shown = found_items[:1]
+        for path in found_items[1:]:
+            if estimate_tokens(str(paths_shown + [path])) > budget:
+                break
+            paths_shown.append(path)
+        target_lines.append(f"Paths matching {word}, best first ({describe_matches(found_items, total)}): {paths_shown}")
+
+    if file_index and not relevant_paths:
+        raise LookupError("No files or folders found")
+
+    # the syntax check starts bash, so it runs off the event loop
+    if not file_index and await asyncio.to_thread(is_shell_command, request, config.get("fast_path")):
+        # it's already a valid shell command, no need to wait for the AI to tell us that
+        stats.answered("shell")
+        return Translation(request, request, "shell")
+
+    with stats.timer("context"):
+        context = Context(request, target_lines)
+        cache_key = context.cache_key(config.data.get("api_model"))
+    ai_cmd = response_cache.get(cache_key) if config.get("response_cache") else None
+
+    if ai_cmd:
+        speculation.cancel()
+        stats.answered("cache")
+        return Translation(request, ai_cmd, "cache", cache_key, relevant_paths, "cached")
+    if (
+        context.examples
+        and context.examples[0][0] >= config.get("examples_direct_threshold")
+        and normalize_request(context.examples[0][1]) == normalize_request(request)
+    ):
+        # this was asked before, maybe in another folder, the command that was accepted then will do.
+        # the similarity ignores word order, "copy a to b" is as similar to "copy b to a" as it gets,
+        # so requests that are only similar are left to the AI, with the example to go by
+        speculation.cancel()
+        stats.answered("example")
+        return Translation(request, context.examples[0][2], "example", cache_key, relevant_paths, f"accepted before for '{context.examples[0][1]}'")
+    if speculated := speculation.take(request, cache_key):
+        try:
+            command = await speculated
+        except Exception:
+            # it failed while the request was still being typed, maybe a while ago. a new attempt decides whether the AI is down
+            pass
+        else:
+            stats.answered("speculation")
+            return Translation(request, command, "speculation", cache_key, relevant_paths, "speculated")
+
+    stats.answered("ai")
+    return Translation(request, await generate(context.messages(), show=show), "ai", cache_key, relevant_paths)
+
+async def main(autoconnect):
+    global using_ai, auto, hide_cmd, session
+
+    session = create_session()
+    if autoconnect:
+        connection.connect(config)
+
+    while True:
+        try:
+            connection.report_error()
+            jobs.announce()
+
+            cmd = await session.prompt_async(shell_prompt)
+            # what the prompt showed when enter was pressed: typed for the AI, or for a plain shell
+            typed_for_ai = connection.status != "disconnected"
+            cmd_split = cmd.split(" ")
+
+            match cmd:
+                case "exit":
+                    if jobs.running() and not jobs.warned:
+                        print("there are running jobs. 'exit' again hangs them up and exits, 'jobs' lists them")
+                        jobs.warned = True
+                        continue
+                    jobs.hang_up()
+                    sys.exit()
+                case "auto":
+                    if not auto:
+                        if await confirm_async(f"{colored.Fore.red}Warning: automatic mode will run the AI's suggested commands without your confirmation! Are you sure?{colored.Style.reset}"):
+                            auto = toggle_bool(auto, "automatic command execution")
+                        hide_cmd = False
+                    else:
                         auto = toggle_bool(auto, "automatic command execution")
-                    hide_cmd = False
-                else:
-                    auto = toggle_bool(auto, "automatic command execution")
-            case "hide":
-                if not auto:
-                    print("turn on automatic execution first with 'auto'")
-                    continue
+                case "hide":
+                    if not auto:
+                        print("turn on automatic execution first with 'auto'")
+                        continue
 
-                hide_cmd = toggle_bool(hide_cmd, "command hiding")
-            case "settings":
-                config.launch_editor()
-            case "config":
-                config.launch_editor()
-            case "connect":
-                if using_ai:
-                    print("already connected!")
-                    continue
+                    hide_cmd = toggle_bool(hide_cmd, "command hiding")
+                case "settings" | "config":
+                    # the editor has the terminal, but jobs and connection checks keep going in the meantime
+                    await asyncio.to_thread(config.launch_editor)
+                case "connect":
+                    if connection.status != "disconnected":
+                        print("already connected!")
+                        continue
 
-                client = ai_connect(config)
-                if client:
-                    using_ai = True
-            case "disconnect":
-                if not using_ai:
-                    print("already disconnected!")
-                    continue
+                    connection.connect(config)
+                case "disconnect":
+                    if connection.status == "disconnected":
+                        print("already disconnected!")
+                        continue
 
-                using_ai = False
-                print_color("disconnected", colored.Fore.sky_blue_1)
-            case "help":
-                print("""
+                    connection.disconnect()
+                    print_color("disconnected", colored.Fore.sky_blue_1)
+                case "stats":
+                    stats.show()
+                    connection.show()
+                case "cache" | "cache stats":
+                    show_cache()
+                case "cache clear":
+                    clear_cache()
+                case "jobs":
+                    jobs.show()
+                case _ if cmd_split[0] in ("fg", "bg") and len(cmd_split) <= 2:
+                    job = jobs.find(cmd_split[1] if len(cmd_split) == 2 else None)
+                    if not job:
+                        continue
+                    if cmd_split[0] == "fg":
+                        print_color(job.command, colored.Fore.sky_blue_1)
+                        await job.bring_to_foreground()
+                    elif job.state == "stopped":
+                        job.resume()
+                        print(job.describe())
+                    else:
+                        print(f"job {job.number} is already {'done' if job.state == 'done' else 'running'}")
+                case _ if cmd_split[0] == "kill" and any(arg.startswith("%") for arg in cmd_split[1:]):
+                    jobs.kill(cmd_split[1:])
+                case _ if cmd == "context" or cmd.startswith("context "):
+                    Context(cmd[len("context"):].strip()).show()
+                case "help":
+                    print("""
 exit:       exit the shell
 settings:   edit the settings
 auto:       toggle auto execution mode (WARNING: dangerous! disables confirmation before running suggested commands. will still ask for confirmation when running root commands)
 hide:       toggle command hiding (hides generated commands prior to running them)
 connect:    reconnect to the AI in case a disconnection occured
 disconnect: disconnect from the AI, switch to an AI-less shell
+context:    show the context that's sent to the AI along with requests, with token counts. 'context <request>' also shows the examples picked for it
+stats:      show where the time went this session: percentiles per phase of a request, token counts and where answers came from
+jobs:       list the background jobs. 'fg [n]' brings one to the foreground (Ctrl+Z stops it again), 'bg [n]' continues a stopped one, 'kill [-SIGNAL] %n' signals one
+cache:      show how much the caches of scanned folders and AI responses hold. 'cache clear' clears them
 help:       display help
 
 Type what you want the shell to do, then press enter. The AI will then generate a shell command and ask you if you want to run it.
-You can also just type normal shell commands, which will run if the AI doesn't modify the command.
+You can also just type normal shell commands. Ones that are clearly already commands run right away, others run if the AI doesn't modify them. The 'fast_path' setting controls this: off, safe or aggressive.
+Commands run in one bash that stays open, so cd, export, alias and functions carry over between commands. Ctrl+Z does nothing for them, end a command with & to run it in the background instead. Set 'shell_mode' to subprocess to start a new shell for every command instead.
+When a request refers to the last command, like "fix that error" or "why did it fail", the AI sees that command, its exit status and the end of its output ('output_token_budget'). 'output_context' can be auto, always or off.
+Commands you accept are remembered. Similar requests show them to the AI as examples ('examples_count'), and a request that's the same as an earlier one, word for word, reuses its command right away ('examples_direct_threshold', above 1 turns that off).
+To use several AI servers, list them in 'api_endpoints' (each with a url, and optionally a key and model). Requests go to the fastest one that's up, and fail over to the others. With 'api_hedge' on, a request that's slower than usual is also sent to the next server, and the first answer wins.
+From scripts, 'aish.py -c "<request>"' prints the command for one request, and 'aish.py --batch <file>' translates many at once into JSON lines. --run safe or --run all also runs them, see 'aish.py --help'.
+A command or request that ends with & runs as a background job, and the prompt comes back right away. Jobs get a terminal of their own, but not the shell's aliases and functions. The end of what they print is kept ('job_output_kb') until 'fg' shows it, and you're told at the prompt when one finishes.
+What you type is colored as you go: commands like a shell would, requests for the AI in a color of their own. 'highlighting' turns that off.
+With the 'speculative' setting on, the AI is asked while you're still typing, so the answer is often ready when you press enter.
 
 You can find and target files within the current folder (even nested folders) by prepending the filename with a '@'. Example: cat @aish.py will search for the file and then read it.
     """.strip())
-            case "":
-                pass
-            case _:
-                # parse one-word commands
-                if len(cmd_split) == 1:
-                    match cmd_split[0]:
-                        case "cd":
-                            os.chdir(os.path.expanduser("~"))
-                            continue
+                case "":
+                    pass
+                case _:
+                    # a request can end with & too, whatever it's answered with then runs in the background
+                    cmd, background = split_background(cmd)
+                    stats.begin(cmd)
+
+                    # parse one-word commands
+                    if len(cmd_split) == 1:
+                        match cmd_split[0]:
+                            case "cd":
+                                os.chdir(os.path.expanduser("~"))
+                                continue
+
+                    # commands that run as they are don't wait for a connection check, even one that's timing out
+                    if "@" not in cmd and await asyncio.to_thread(is_shell_command, cmd, config.get("fast_path")):
+                        stats.answered("shell")
+                        cmd = process_cmd(cmd)
+                        if cmd:
+                            await run_command(cmd, background)
+                        continue
 
-                # recursively retrieve the file structure from the current directory and use it to find and target any paths the user has specified with a @
-                activated_target = False
-                dir_tree = False
-                relevant_paths = []
-                for index, word in enumerate(cmd_split):
-                    if word[0] == "@":
-                        if not activated_target:
-                            activated_target = True
-
-                        print(f"{colored.Fore.sky_blue_1}>> targeting {word[1:]}{colored.Style.reset}")
-                        if not dir_tree:
-                            dir_tree = get_dir_list(os.getcwd())
-
-                        found_items = []
-                        for item in dir_tree:
-                            if word[1:] in os.path.basename(item):
-                                if os.path.isdir(item):
-                                    # add trailing slash
-                                    item += "/"
-
-                                found_items.append(item)
-                                relevant_paths.append(item)
-
-                        if not found_items:
-                            print(f"No paths found for {word}")
-                            continue
+                    # a connection check that's still running decides whether the AI gets to see this
+                    using_ai = await run_cancellable(connection.wait())
+                    if using_ai is None:
+                        # cancelled with Ctrl+C
+                        continue
+                    connection.report_error()
 
-                        if not using_ai:
-                            # if AI is disconnected, let the user decide the best path
-                            choices = [(choice, choice) for choice in found_items]
+                    if not using_ai and typed_for_ai:
+                        # the fast path didn't take it for a command, so it's probably a request. bash would run
+                        # "rm the old logs" on files called the, old and logs
+                        print("the AI isn't available, so your input wasn't run. type it again to run it as a shell command")
+                        continue
 
-                            cmd_split[index] = prompt_toolkit.shortcuts.choice(
-                                message=f"Please choose a target for {word}:",
-                                options=choices,
-                                default=word
-                            )
-                            continue
+                    if not using_ai:
+                        # just execute the command like a normal shell, with the user picking the paths for @ targets
+                        stats.answered("shell")
+                        cmd = await choose_targets(cmd)
+                        if cmd:
+                            cmd = process_cmd(cmd)
+                        if cmd:
+                            await run_command(cmd, background)
+                        continue
 
-                if activated_target and not relevant_paths:
-                    print("No files or folders found")
-                    continue
+                    try:
+                        translation = await run_cancellable(translate(cmd, show=not hide_cmd))
+                    except LookupError as e:
+                        print(e)
+                        continue
+                    except Exception as e:
+                        print_color(f"Failed to connect to AI! error: {e}", colored.Fore.red)
+                        # with other servers still up, the next request goes to one of them
+                        if not connection.available():
+                            connection.disconnect()
+                            print("use `connect` to reconnect to the AI when ready.")
+                        continue
 
-                # re-join modified command
-                cmd = " ".join(cmd_split)
+                    if translation is None:
+                        # cancelled with Ctrl+C
+                        continue
 
-                if not using_ai:
-                    # just execute the command like a normal shell
-                    cmd = process_cmd(cmd)
-                    if cmd:
-                        subprocess.run(cmd, env=env_vars, shell=True, text=True)
-                    continue
+                    ai_cmd = translation.command
+                    if translation.source == "shell":
+                        cmd = process_cmd(cmd)
+                        if cmd:
+                            await run_command(cmd, background)
+                        continue
 
-                if relevant_paths:
-                    # let the AI decide the best path
-                    relevant_paths = f"\nYou can find target files at one of these paths: {relevant_paths}"
-
-                prompt = [
-                    {
-                        "role": "system",
-                        "content": f"You are currently in directory `{os.getcwd()}`.\nUser's home directory is `{os.path.expanduser('~')}`.\n{relevant_paths}\nEnvironment variables: {env_vars_display}\nThe current date is {datetime.datetime.now().strftime('%b %d %Y %H:%M:%S')}.\nFiles in current directory: {os.listdir()}.\nSystem information: {sys_info}"
-                    },
-                    {
-                        "role": "system",
-                        "content": config.data.get("prompt")
-                    },
-                    {
-                        "role": "user",
-                        "content": cmd
-                    }
-                ]
+                    if translation.note and ai_cmd and not hide_cmd:
+                        print(f"{colored.Fore.sky_blue_1}>> {ai_cmd}{colored.Style.reset} ({translation.note})")
 
-                try:
-                    stream = client.chat.completions.create(
-                        model=config.data.get("api_model"),
-                        messages=prompt,
-                        stream=True
-                    )
-
-                    # stream llm's response
-                    chunks = []
-                    if not hide_cmd:
-                        print(f"{colored.Fore.sky_blue_1}>> ", end="")
-                    for chunk in stream:
-                        chunk_s = chunk.choices[0].delta.content
-                        if chunk_s:
-                            chunks.append(chunk_s)
-
-                            if not hide_cmd:
-                                print(chunk_s, end="", flush=True)
-                    if not hide_cmd:
-                        print(colored.Style.reset)
-
-                    ai_cmd = "".join(chunks)
-                    ai_cmd_split = ai_cmd.split(" ")
-                except Exception as e:
-                    print_color(f"Failed to connect to AI! error: {e}", colored.Fore.red)
-                    using_ai = False
-
-                    print("use `connect` to reconnect to the AI when ready.")
-                    continue
+                    if not ai_cmd:
+                        print_color("The AI didn't answer with a command. If it's a reasoning model, it may need a higher 'api_max_tokens'.", colored.Fore.red)
+                        continue
 
-                if ai_cmd.lower().strip() == cmd.lower().strip():
-                    # just run it if it's the same as what the user typed - it's probably a shell command the user entered
+                    if ai_cmd.lower().strip() == cmd.lower().strip():
+                        # just run it if it's the same as what the user typed - it's probably a shell command the user entered
+                        if config.get("response_cache"):
+                            response_cache.put(translation.cache_key, cmd, config.data.get("api_model"), ai_cmd)
 
-                    ai_cmd = process_cmd(ai_cmd)
-                    if ai_cmd:
-                        subprocess.run(ai_cmd, env=env_vars, shell=True, text=True)
-                    continue
+                        ai_cmd = process_cmd(ai_cmd)
+                        if ai_cmd:
+                            await run_command(ai_cmd, background)
+                        continue
 
-                skip_confirm = False
+                    skip_confirm = False
 
-                # check generated command for unsafe instructions
-                unsafe = False
-                for word in ai_cmd_split:
-                    if word.lower() in ("rm", "del", "delete", "-delete", "--delete", "remove", "-r", "-rf", "dd", "wipe", "shred", "mkfs", "format", "fdisk", "parted", "sh", "bash", "zsh", "csh", "fish", "reboot", "shutdown", "poweroff", "halt"):
-                        unsafe = True
+                    # check generated command for unsafe instructions
+                    if translation.unsafe:
+                        if hide_cmd:
+                            print_color(f">> {ai_cmd}", colored.Fore.red)
 
-                if unsafe:
-                    if hide_cmd:
-                        print_color(f">> {ai_cmd}", colored.Fore.red)
+                        if not await confirm_async(f"{colored.Fore.red}Warning: Generated command contains potentially unsafe instructions! Are you sure?{colored.Style.reset}"):
+                            continue
 
-                    if not confirm(f"{colored.Fore.red}Warning: Generated command contains potentially unsafe instructions! Are you sure?{colored.Style.reset}"):
-                        continue
+                    # ask for extra confirmation if the command is a sudo command
+                    if translation.root:
+                        if hide_cmd:
+                            print(f">> {ai_cmd}")
 
-                # ask for extra confirmation if the command is a sudo command
-                if ai_cmd_split[0].lower() in ("sudo", "su"):
-                    if hide_cmd:
-                        print(f">> {ai_cmd}")
+                        if not await confirm_async(f"{colored.Fore.red}really execute as root?{colored.Style.reset}"):
+                            continue
 
-                    if not confirm(f"{colored.Fore.red}really execute as root{colored.Style.reset}"):
-                        continue
+                        skip_confirm = True
 
-                    skip_confirm = True
+                    if not auto and not skip_confirm:
+                        with stats.timer("confirm"):
+                            confirmed = await confirm_async("execute?")
+                        if not confirmed:
+                            continue
 
-                if not auto and not skip_confirm:
-                    if not prompt_toolkit.shortcuts.confirm("execute?"):
-                        continue
+                    # finally, after all those safety checks, go ahead and execute.
+                    # only commands that made it this far get cached, so rejected answers are asked again next time
+                    translation.accept()
+                    ai_cmd = process_cmd(ai_cmd)
+                    if ai_cmd:
+                        await run_command(ai_cmd, background)
+        except KeyboardInterrupt:
+            continue
+        except Exception as e:
+            print_color(f"error: {e}", colored.Fore.red)
+            traceback.print_exc()
+            pass
+        finally:
+            stats.end()
+            print()
 
-                # finally, after all those safety checks, go ahead and execute
-                ai_cmd = process_cmd(ai_cmd)
-                if ai_cmd:
-                    subprocess.run(ai_cmd, env=env_vars, shell=True, text=True)
-    except KeyboardInterrupt:
-        continue
+def interactive():
+    """
+        runs the interactive shell, after the intro and setting up the configuration on the first run
+    """
+    if config.data.get("show_intro"):
+        print_color(config.data.get("intro"), colored.Fore.yellow)
+
+    autoconnect = config.data.get("autoconnect")
+    if config.first_run:
+        config.write_defaults()
+        if prompt_toolkit.shortcuts.confirm("Would you like to set up the configuration now?"):
+            config.launch_editor()
+        else:
+            print("Okay. You can launch the editor at any time by typing 'settings' or 'config'.")
+            print("Once you've set things up, type 'connect' to connect to the AI.")
+            autoconnect = False
+
+    signal.signal(signal.SIGINT, signal_handler)
+    asyncio.run(main(autoconnect))
+
+# --------
+# NON-INTERACTIVE MODE
+
+async def run_unattended(cmd, capture):
+    """
+        runs a command that nobody is watching. with capture, its stdin is /dev/null and its output is returned
+        instead of shown. returns (exit status, stdout, stderr)
+    """
+    pipe = asyncio.subprocess.PIPE if capture else None
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        env=env_vars,
+        stdin=asyncio.subprocess.DEVNULL if capture else None,
+        stdout=pipe,
+        stderr=pipe
+    )
+    stdout, stderr = await process.communicate()
+    if capture:
+        return process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    return process.returncode, None, None
+
+def run_refusal(translation, policy):
+    """
+        returns why the policy given with --run doesn't allow running a translated command, or None if it does
+    """
+    if not translation.command:
+        return "the AI didn't answer with a command"
+    if policy == "all":
+        return None
+    if translation.unsafe:
+        return "it contains potentially unsafe instructions, --run all runs it anyway"
+    if translation.root:
+        return "it runs as root, --run all runs it anyway"
+    return None
+
+async def translate_request(request):
+    """
+        translate() for the non-interactive mode: returns (the translation or None, what went wrong or None)
+    """
+    try:
+        return await translate(request), None
     except Exception as e:
-        print_color(f"error: {e}", colored.Fore.red)
-        traceback.print_exc()
-        pass
-    finally:
-        print()
+        return None, str(e) or type(e).__name__
+
+async def run_request(request, policy, as_json):
+    """
+        handles 'aish -c': prints the command for request, or runs it if the policy allows. returns the exit status
+    """
+    translation, error = await translate_request(request)
+    if error:
+        print_color(f"aish: {error}", colored.Fore.red, file=sys.stderr)
+        return 1
+
+    record = translation.record()
+    refusal = run_refusal(translation, policy) if policy != "never" else None
+    status = None
+    if policy != "never" and not refusal:
+        if not as_json:
+            # like set -x, so it's clear what ran
+            print(f"+ {translation.command}", file=sys.stderr)
+        status, record["stdout"], record["stderr"] = await run_unattended(translation.command, capture=as_json)
+    record.update(ran=status is not None, status=status, skipped=refusal)
+
+    if as_json:
+        print(json.dumps(record))
+    elif status is None:
+        print(translation.command)
+    if refusal:
+        print_color(f"aish: not running {translation.command!r}: {refusal}", colored.Fore.red, file=sys.stderr)
+        return 1
+    if not translation.command:
+        return 1
+    return status or 0
+
+async def run_batch(file, jobs, policy, keep_going):
+    """
+        handles 'aish --batch': translates every line of file, up to jobs of them at once, and prints one JSON line per request
+        in the order they came in. commands are run one after the other in that order if the policy allows, until one fails.
+        returns the exit status
+    """
+    pending = collections.deque()  # (line number, request, translation task), in input order
+    failed = False
+
+    async def finish_first():
+        nonlocal failed
+        number, request, task = pending.popleft()
+        translation, error = await task
+        if error:
+            failed = True
+            print(json.dumps({"line": number, "request": request, "error": error}), flush=True)
+            return
+
+        record = {"line": number, **translation.record()}
+        status = None
+        refusal = None
+        if policy != "never":
+            refusal = run_refusal(translation, policy)
+            if not refusal and failed and not keep_going:
+                refusal = "an earlier request failed, --keep-going runs the rest anyway"
+            if not refusal:
+                status, record["stdout"], record["stderr"] = await run_unattended(translation.command, capture=True)
+                failed = failed or status != 0
+            else:
+                failed = True
+        record.update(ran=status is not None, status=status, skipped=refusal)
+        print(json.dumps(record), flush=True)
+
+    number = 0
+    while line := await asyncio.to_thread(file.readline):
+        number += 1
+        request = line.strip()
+        if not request or request.startswith("#"):
+            continue
+
+        # a slow request holds up the ones after it, so at most jobs requests are ever waiting to be printed
+        if len(pending) >= jobs:
+            await finish_first()
+        pending.append((number, request, asyncio.ensure_future(translate_request(request))))
+
+    while pending:
+        await finish_first()
+    return 1 if failed else 0
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="aish",
+        description="AI.sh, a shell that turns what you ask for into commands. Without arguments, the interactive shell starts."
+    )
+    parser.add_argument("-c", dest="request", metavar="REQUEST", help="translate one request, print the command and exit")
+    parser.add_argument("-b", "--batch", metavar="FILE", nargs="?", const="-", help="translate every line of FILE (or stdin) and print the results as JSON lines")
+    parser.add_argument("-j", "--jobs", type=int, default=config.get("batch_jobs"), help="how many requests of a batch are translated at once")
+    parser.add_argument("--run", choices=("never", "safe", "all"), default="never",
+        help="which translated commands to run: none (the default), only ones that pass the safety check, or all of them")
+    parser.add_argument("--keep-going", action="store_true", help="in batch mode, keep running commands after one failed")
+    parser.add_argument("--json", action="store_true", help="with -c, print the result as a JSON line like batch mode does")
+    return parser.parse_args()
+
+def cli():
+    config.load()
+    args = parse_args()
+    if args.request is None and args.batch is None:
+        interactive()
+        return
+
+    try:
+        if args.request is not None:
+            status = asyncio.run(run_request(args.request, args.run, args.json))
+        elif args.batch == "-":
+            status = asyncio.run(run_batch(sys.stdin, max(args.jobs, 1), args.run, args.keep_going))
+        else:
+            with open(args.batch) as f:
+                status = asyncio.run(run_batch(f, max(args.jobs, 1), args.run, args.keep_going))
+    except KeyboardInterrupt:
+        status = 130
+    except OSError as e:
+        print_color(f"aish: {e}", colored.Fore.red, file=sys.stderr)
+        status = 1
+    sys.exit(status)
+
+if __name__ == "__main__":
+    cli()
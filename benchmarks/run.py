@@ -0,0 +1,315 @@
+#!/bin/env python
+
+"""
+    Runs the aish benchmarks headless and prints the results as JSON.
+
+    - startup: time until the first prompt is drawn, and how much of that is aish rather than the interpreter starting
+      (see startup.py). the exit status is 1 if that overhead is above --startup-target-ms
+    - end_to_end: time from pressing enter on a request until aish asks whether to execute the answer,
+      against a local stub server with a fixed time to first token and token rate (see stub_server.py)
+    - targets: scanning a synthetic tree for @ targets with nothing cached, loading the complete index from the cache dir,
+      refreshing it in memory, and searching it (see trees.py)
+    - completer: tab completion in the tree's widest folder, before and after its listing is cached, and of executables
+    - peak RSS of aish during the end to end run, and of this process after building the indexes
+
+    With --compare, every timing and memory figure is checked against an earlier results file,
+    and the exit status is 1 if any of them got worse by more than --tolerance.
+
+    usage: benchmarks/run.py [--sizes 10k,100k,1m] [--runs 5] [--ttft 0.2] [--tokens-per-second 50] [--startup-target-ms 250] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import pty
+import re
+import resource
+import select
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import startup
+import trees
+from stub_server import StubServer
+
+AISH = startup.AISH
+
+def median_ms(times):
+    return statistics.median(times) * 1000
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+class Terminal:
+    """
+        aish running in a pseudo terminal, with just enough of a terminal emulation to drive it
+    """
+    def __init__(self, home, timeout=30):
+        self.timeout = timeout
+        env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"), XDG_DATA_HOME=os.path.join(home, ".local/share"), TERM="xterm")
+        self.master, slave = pty.openpty()
+        self.process = subprocess.Popen([sys.executable, AISH], stdin=slave, stdout=slave, stderr=slave, env=env, cwd=home)
+        os.close(slave)
+        self.output = b""
+
+    def text(self):
+        return re.sub(rb"\x1b\[[0-9;?]*[a-zA-Z]", b"", self.output).decode(errors="replace")
+
+    def wait_for(self, text):
+        """
+            reads output until text shows up in what was read since the last wait, and returns how long that took
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < self.timeout:
+            ready, _, _ = select.select([self.master], [], [], 0.005)
+            if not ready:
+                continue
+            data = os.read(self.master, 65536)
+            self.output += data
+            # answer cursor position requests like a real terminal would
+            if b"\x1b[6n" in data:
+                os.write(self.master, b"\x1b[1;1R")
+            if text in self.text():
+                self.output = b""
+                return time.perf_counter() - start
+        raise RuntimeError(f"aish didn't show {text!r} within {self.timeout} seconds. output: {self.text()[-500:]!r}")
+
+    def send(self, text):
+        os.write(self.master, text.encode())
+
+    def close(self):
+        """
+            exits aish and returns its peak RSS in MB
+        """
+        self.send("exit\r")
+        try:
+            _, _, usage = os.wait4(self.process.pid, 0)
+        finally:
+            os.close(self.master)
+        return usage.ru_maxrss / 1024
+
+def bench_end_to_end(server, runs):
+    home = tempfile.mkdtemp(prefix="aish-bench-")
+    with open(os.path.join(home, ".aish.conf"), 'w') as f:
+        # every request has to go to the AI: nothing cached, no earlier commands to reuse
+        f.write(f"""
+api_url: {server.url}
+api_key: benchmark
+api_model: stub
+autoconnect: true
+show_intro: false
+response_cache: false
+examples_direct_threshold: 2
+""")
+
+    terminal = Terminal(home)
+    try:
+        terminal.wait_for(")>")
+        # give the background connection check time to finish
+        time.sleep(1)
+        times = []
+        for run in range(runs):
+            terminal.send(f"show how much disk space is free, attempt {run}\r")
+            times.append(terminal.wait_for("execute?"))
+            terminal.send("n\r")
+            terminal.wait_for(")>")
+    finally:
+        rss = terminal.close()
+        shutil.rmtree(home, ignore_errors=True)
+
+    # what the model itself takes, everything above that is aish
+    model_ms = (server.ttft + (len(server.tokens(server.answer)) - 1) / server.tokens_per_second) * 1000
+    return {
+        "runs": runs,
+        "latency_ms": median_ms(times),
+        "model_ms": model_ms,
+        "overhead_ms": median_ms(times) - model_ms,
+        "peak_rss_mb": rss,
+    }
+
+def load_aish(home):
+    """
+        imports aish.py as a module, with its config and caches in home
+    """
+    os.environ.update(HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"), XDG_DATA_HOME=os.path.join(home, ".local/share"))
+    with open(os.path.join(home, ".aish.conf"), 'w') as f:
+        f.write("autoconnect: false\nshow_intro: false\n")
+    spec = importlib.util.spec_from_file_location("aish", AISH)
+    aish = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(aish)
+    aish.config.load()
+    return aish
+
+def bench_targets(aish, root, runs):
+    """
+        a scan that runs out of its time or entry budget is continued on the next @, so the first scan of a tree,
+        the number of scans until it's complete, and loading and refreshing a complete index are measured separately
+    """
+    queries = ("config", "readme_12", "wide/report", "hndlr")
+
+    def forget(keep_saved):
+        aish.file_indexes.clear()
+        if not keep_saved:
+            for path in glob.glob(os.path.join(aish.get_cache_dir(), "index-*.json")):
+                os.remove(path)
+
+    first = []
+    full = []
+    for _ in range(runs):
+        forget(keep_saved=False)
+        seconds, index = timed(aish.get_file_index, root)
+        first.append(seconds)
+        first_entries = len(index)
+        first_complete = index.complete
+
+        scans = 1
+        while not index.complete and scans < 100:
+            seconds += timed(aish.get_file_index, root)[0]
+            scans += 1
+        full.append(seconds)
+
+    warm = []
+    hot = []
+    for _ in range(runs):
+        forget(keep_saved=True)
+        warm.append(timed(aish.get_file_index, root)[0])
+        hot.append(timed(aish.get_file_index, root)[0])
+
+    index = aish.get_file_index(root)
+    search = {}
+    for query in queries:
+        search[query] = median_ms([timed(index.search, query, aish.config.get("target_max_results"))[0] for _ in range(runs)])
+
+    return {
+        "entries": len(index),
+        "index_memory_mb": index.memory / 1024 / 1024,
+        "first_scan_ms": median_ms(first),
+        "first_scan_entries": first_entries,
+        "first_scan_complete": first_complete,
+        "full_scan_ms": median_ms(full),
+        "scans_until_complete": scans,
+        "warm_load_ms": median_ms(warm),
+        "hot_refresh_ms": median_ms(hot),
+        "search_ms": search,
+    }
+
+def bench_completer(aish, root, runs):
+    from prompt_toolkit.document import Document
+
+    def complete(completer, text):
+        return list(completer.get_completions(Document(text), None))
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        cold = []
+        for _ in range(runs):
+            completer = aish.TabCompleter()
+            cold.append(timed(complete, completer, "ls wide/report_1")[0])
+        cached = [timed(complete, completer, "ls wide/report_1")[0] for _ in range(runs)]
+        everything = [timed(complete, completer, "ls wide/")[0] for _ in range(runs)]
+        executables = [timed(complete, completer, "py")[0] for _ in range(runs)]
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "cold_prefix_ms": median_ms(cold),
+        "cached_prefix_ms": median_ms(cached),
+        "cached_all_ms": median_ms(everything),
+        "executables_ms": median_ms(executables),
+    }
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(results, baseline, tolerance):
+    """
+        returns a description of every timing or memory figure that got worse than the baseline by more than tolerance
+    """
+    old = flatten(baseline)
+    regressions = []
+    for key, value in flatten(results).items():
+        if not key.endswith(("_ms", "_mb")) or key not in old or key.endswith("model_ms"):
+            continue
+        # a millisecond or megabyte of noise on tiny numbers isn't a regression
+        if value > old[key] * (1 + tolerance) and value - old[key] > 1:
+            regressions.append(f"{key}: {old[key]:.1f} -> {value:.1f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="run the aish benchmarks")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="comma separated sizes of the synthetic trees")
+    parser.add_argument("--tree-dir", default=os.path.join(tempfile.gettempdir(), "aish-trees"), help="where the trees are created and reused from")
+    parser.add_argument("--runs", type=int, default=5, help="number of timed runs per measurement")
+    parser.add_argument("--ttft", type=float, default=0.2, help="time to first token of the stub server, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="token rate of the stub server")
+    parser.add_argument("--startup-target-ms", type=float, default=startup.TARGET_MS, help="most time aish may add to the interpreter's own start")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="how much worse than the baseline is still fine, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    results = {"benchmark": "suite", "python": sys.version.split()[0], "runs": args.runs}
+
+    home = startup.make_home()
+    startup.time_to_prompt(home)
+    startup_times = [startup.time_to_prompt(home)[0] for _ in range(args.runs)]
+    interpreter_times = [startup.interpreter_start(home) for _ in range(args.runs)]
+    # the fastest runs, like startup.py
+    overhead = (min(startup_times) - min(interpreter_times)) * 1000
+    results["startup"] = {
+        "time_to_prompt_ms": median_ms(startup_times),
+        "interpreter_start_ms": min(interpreter_times) * 1000,
+        "overhead_ms": overhead,
+        "target_ms": args.startup_target_ms,
+        "passed": overhead <= args.startup_target_ms,
+    }
+
+    server = StubServer(ttft=args.ttft, tokens_per_second=args.tokens_per_second).start()
+    try:
+        results["end_to_end"] = bench_end_to_end(server, args.runs)
+    finally:
+        server.stop()
+
+    tree_paths = trees.make_trees(args.tree_dir, args.sizes.split(","))
+    bench_home = tempfile.mkdtemp(prefix="aish-bench-")
+    try:
+        aish = load_aish(bench_home)
+        results["targets"] = {}
+        results["completer"] = {}
+        for name, root in tree_paths.items():
+            results["targets"][name] = bench_targets(aish, root, args.runs)
+            results["completer"][name] = bench_completer(aish, root, args.runs)
+        results["benchmark_peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        shutil.rmtree(bench_home, ignore_errors=True)
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            results["regressions"] = compare(results, json.load(f), args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+
+    sys.exit(1 if results.get("regressions") or not results["startup"]["passed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/bin/env python
+
+"""
+    Measures how long aish takes to start.
+
+    Runs aish.py in a pseudo terminal with a throwaway home directory, and times how long it takes
+    until the first prompt is drawn. One extra run with `python -X importtime` lists the slowest imports.
+
+    Python itself takes a while to start, 60 to 100 ms for `python -c pass` with a pyenv install and a big site-packages,
+    and that's out of aish's hands. So the target is for the overhead: the fastest time to first prompt minus the fastest
+    time the same interpreter takes to start and exit in the same pseudo terminal. The fastest runs are compared because
+    a busy machine only ever adds time, and on a single core the median overhead swings between about 120 and 250 ms. Most of the overhead is importing
+    prompt_toolkit and asyncio. The bash lexer (pygments) is loaded in a background thread once the prompt is drawn, see
+    Highlighter in aish.py, so some of it can overlap with the first render.
+    Exits with status 1 if the overhead is above the target.
+
+    usage: benchmarks/startup.py [--runs 5] [--target-ms 250] [--json]
+"""
+
+import argparse
+import json
+import os
+import pty
+import re
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+AISH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "aish.py")
+
+CONFIG = """
+api_url: http://127.0.0.1:9/v1
+api_key: benchmark
+api_model: benchmark
+autoconnect: false
+show_intro: false
+"""
+
+# the default target for what aish adds to the interpreter's own start, see the docstring
+TARGET_MS = 250
+
+def make_home():
+    home = tempfile.mkdtemp(prefix="aish-bench-")
+    with open(os.path.join(home, ".aish.conf"), 'w') as f:
+        f.write(CONFIG)
+    return home
+
+def interpreter_start(home, timeout=30):
+    """
+        returns how many seconds the interpreter takes to start and exit, in a pty like aish gets
+    """
+    env = dict(os.environ, HOME=home, TERM="xterm")
+    master, slave = pty.openpty()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", "pass"], stdin=slave, stdout=slave, stderr=slave, env=env, cwd=home)
+    os.close(slave)
+    try:
+        process.wait(timeout=timeout)
+        return time.perf_counter() - start
+    finally:
+        os.close(master)
+
+def time_to_prompt(home, importtime=False, timeout=30):
+    """
+        starts aish in a pty and returns (seconds until the prompt showed up, stderr output)
+    """
+    env = dict(os.environ, HOME=home, XDG_CACHE_HOME=os.path.join(home, ".cache"), TERM="xterm")
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + [AISH]
+
+    # -X importtime writes a lot to stderr, a pipe would fill up and block aish
+    stderr = tempfile.TemporaryFile()
+    master, slave = pty.openpty()
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stdin=slave, stdout=slave, stderr=stderr, env=env, cwd=home)
+    os.close(slave)
+
+    output = b""
+    elapsed = None
+    try:
+        while time.perf_counter() - start < timeout:
+            ready, _, _ = select.select([master], [], [], 0.01)
+            if not ready:
+                continue
+
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                break
+            output += data
+
+            # answer cursor position requests like a real terminal would
+            if b"\x1b[6n" in data:
+                os.write(master, b"\x1b[1;1R")
+
+            text = re.sub(rb"\x1b\[[0-9;?]*[a-zA-Z]", b"", output)
+            if b")>" in text:
+                elapsed = time.perf_counter() - start
+                break
+
+        os.write(master, b"exit\r")
+        process.wait(timeout=timeout)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        os.close(master)
+
+    if elapsed is None:
+        raise RuntimeError(f"aish didn't show a prompt within {timeout} seconds. output: {output[-500:]!r}")
+
+    stderr.seek(0)
+    return elapsed, stderr.read().decode(errors="replace")
+
+def slowest_imports(importtime_output, count=10):
+    """
+        returns [(module, cumulative microseconds)] for the top-level imports that took the longest
+    """
+    imports = []
+    for line in importtime_output.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)", line)
+        # only direct imports of aish.py, nested ones are already counted in their parent's cumulative time
+        if match and not match.group(3):
+            imports.append((match.group(4), int(match.group(2))))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description="measure aish's cold start time")
+    parser.add_argument("--runs", type=int, default=5, help="number of timed runs")
+    parser.add_argument("--target-ms", type=float, default=TARGET_MS, help="fail if the fastest time to first prompt is more than this above the interpreter's own start")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    home = make_home()
+
+    # the first run warms the disk cache and creates the cache dir, so it isn't counted
+    time_to_prompt(home)
+    times = [time_to_prompt(home)[0] * 1000 for _ in range(args.runs)]
+    interpreter = min(interpreter_start(home) * 1000 for _ in range(args.runs))
+    _, importtime_output = time_to_prompt(home, importtime=True)
+
+    results = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "time_to_prompt_ms": {
+            "min": min(times),
+            "median": statistics.median(times),
+            "max": max(times),
+        },
+        "interpreter_start_ms": interpreter,
+        "overhead_ms": min(times) - interpreter,
+        "target_ms": args.target_ms,
+        "slowest_imports_ms": {module: microseconds / 1000 for module, microseconds in slowest_imports(importtime_output)},
+    }
+    results["passed"] = results["overhead_ms"] <= args.target_ms
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        timing = results["time_to_prompt_ms"]
+        print(f"time to first prompt: median {timing['median']:.1f} ms (min {timing['min']:.1f}, max {timing['max']:.1f}) over {args.runs} runs")
+        print(f"interpreter start: min {results['interpreter_start_ms']:.1f} ms, aish overhead {results['overhead_ms']:.1f} ms")
+        print("slowest imports:")
+        for module, milliseconds in results["slowest_imports_ms"].items():
+            print(f"{milliseconds:10.1f} ms  {module}")
+        print(f"{'PASSED' if results['passed'] else 'FAILED'}: target is {args.target_ms:.0f} ms of overhead")
+
+    sys.exit(0 if results["passed"] else 1)
+
+if __name__ == "__main__":
+    main()
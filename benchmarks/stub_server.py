@@ -0,0 +1,115 @@
+#!/bin/env python
+
+"""
+    A fake OpenAI-compatible server for benchmarks, so they don't depend on a model or a network.
+
+    It answers GET /v1/models and streams POST /v1/chat/completions with a fixed answer. The time to first token
+    and the token rate are configurable, so the time aish itself adds on top of the model can be measured.
+
+    usage: benchmarks/stub_server.py [--port 8765] [--ttft 0.2] [--tokens-per-second 50] [--answer "df -h"]
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wrappers import Request, Response
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 lets aish reuse its connection between requests, like it can with a real server
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args):
+        pass
+
+class StubServer:
+    """
+        Runs the fake server in a background thread. url is the base URL to put in api_url once it's started.
+    """
+    def __init__(self, port=0, ttft=0.2, tokens_per_second=50, answer="df -h"):
+        self.port = port
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.answer = answer
+        self.requests = 0
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.port}/v1"
+
+    def tokens(self, text):
+        # about 3 characters per token, like a real tokenizer on shell commands
+        return [text[i:i + 3] for i in range(0, len(text), 3)]
+
+    def chunk(self, content, finish_reason=None):
+        data = {
+            "id": "stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "stub",
+            "choices": [{"index": 0, "delta": {"content": content} if content is not None else {}, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    def stream(self):
+        time.sleep(self.ttft)
+        for index, token in enumerate(self.tokens(self.answer)):
+            if index:
+                time.sleep(1 / self.tokens_per_second)
+            yield self.chunk(token)
+        yield self.chunk(None, "stop")
+        yield "data: [DONE]\n\n"
+
+    @Request.application
+    def app(self, request):
+        if request.path.rstrip("/").endswith("/models"):
+            return Response(json.dumps({"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "stub"}]}), mimetype="application/json")
+
+        if request.path.rstrip("/").endswith("/chat/completions") and request.method == "POST":
+            self.requests += 1
+            body = request.get_json()
+            if body.get("stream"):
+                return Response(self.stream(), mimetype="text/event-stream")
+
+            time.sleep(self.ttft)
+            return Response(json.dumps({
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer}, "finish_reason": "stop"}],
+            }), mimetype="application/json")
+
+        return Response("not found", status=404)
+
+    def start(self):
+        self.server = make_server("127.0.0.1", self.port, self.app, threaded=True, request_handler=KeepAliveRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="fake OpenAI-compatible server for benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--answer", default="df -h", help="the command every request is answered with")
+    args = parser.parse_args()
+
+    server = StubServer(args.port, args.ttft, args.tokens_per_second, args.answer).start()
+    print(f"serving on {server.url}, press Ctrl+C to stop")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
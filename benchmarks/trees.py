@@ -0,0 +1,74 @@
+#!/bin/env python
+
+"""
+    Creates synthetic directory trees for benchmarks.
+
+    A tree of n entries has a tenth of them in one wide folder, and the rest spread over folders three levels deep,
+    with 50 files per folder. Names are made of common words and extensions, so fuzzy searches have realistic matches.
+    Trees are only created once: a marker file records that a tree is complete, and later runs reuse it.
+
+    usage: benchmarks/trees.py [--dir /tmp/aish-trees] [--sizes 10k,100k,1m]
+"""
+
+import argparse
+import os
+
+words = ("main", "config", "utils", "test", "index", "readme", "setup", "model", "view", "handler", "client", "server", "parser", "cache", "report")
+extensions = (".py", ".js", ".md", ".txt", ".json", ".yaml", ".c", ".h")
+files_per_folder = 50
+marker = ".aish-benchmark-tree"
+
+def parse_size(text):
+    """
+        "10k" -> 10000, "1m" -> 1000000
+    """
+    text = text.strip().lower()
+    multiplier = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+def file_name(number):
+    return f"{words[number % len(words)]}_{number}{extensions[number // len(words) % len(extensions)]}"
+
+def make_tree(root, entries):
+    """
+        creates a tree with about entries files and folders under root, unless it was already made. returns root
+    """
+    marker_path = os.path.join(root, marker)
+    if os.path.exists(marker_path):
+        return root
+
+    wide_count = entries // 10
+    wide = os.path.join(root, "wide")
+    os.makedirs(wide, exist_ok=True)
+    for number in range(wide_count):
+        open(os.path.join(wide, file_name(number)), 'w').close()
+
+    folder = None
+    for number in range(entries - wide_count):
+        leaf = number // files_per_folder
+        if number % files_per_folder == 0:
+            folder = os.path.join(root, f"dir_{leaf // 400:03d}", f"sub_{leaf // 20 % 20:02d}", f"{words[leaf % len(words)]}_{leaf % 20:02d}")
+            os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, file_name(number)), 'w').close()
+
+    with open(marker_path, 'w') as f:
+        f.write(str(entries))
+    return root
+
+def make_trees(directory, sizes):
+    """
+        returns {size name: path to the tree}, creating the trees that don't exist yet
+    """
+    return {name: make_tree(os.path.join(directory, name), parse_size(name)) for name in sizes}
+
+def main():
+    parser = argparse.ArgumentParser(description="create synthetic directory trees for benchmarks")
+    parser.add_argument("--dir", default="/tmp/aish-trees", help="where the trees are created")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="comma separated numbers of entries")
+    args = parser.parse_args()
+
+    for name, path in make_trees(args.dir, args.sizes.split(",")).items():
+        print(f"{name}: {path}")
+
+if __name__ == "__main__":
+    main()